@@ -5,12 +5,57 @@ Handles header and line item creation with proper field mapping
 """
 
 import logging
-from typing import Dict, List, Optional
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
 from datetime import datetime, timedelta
 from app.database import SQLServerManager, PostgreSQLManager
+from app.validator import ValidatedProduct
 
 logger = logging.getLogger(__name__)
 
+# Database identifier used in quotation numbers when a store has none configured
+DEFAULT_DB_ID = '1'
+
+# Line item ExpDate offset (header expiration comes from store defaults)
+DEFAULT_EXPIRATION = timedelta(days=365)
+
+def _truncate(text, max_len: int) -> Optional[str]:
+    """Truncate value to a VARCHAR column length (None for empty values)"""
+    return str(text)[:max_len] if text else None
+
+
+@dataclass(slots=True, frozen=True)
+class StoreContext:
+    """Per-store quotation settings, resolved from the defaults row once per conversion"""
+    defaults: Dict
+    title_prefix: str
+    expiration_delta: timedelta
+    db_id: str
+    status: Optional[int]
+    shipper_id: Optional[int]
+    sales_rep_id: Optional[int]
+    term_id: Optional[int]
+    customer_id: Optional[int]
+
+    @classmethod
+    def from_defaults(cls, defaults: Dict) -> 'StoreContext':
+        """Build context from a get_store_conversion_context() row"""
+        # Only unset (NULL) values fall back: an empty prefix or 0 days is deliberate
+        title_prefix = defaults.get('quotation_title_prefix')
+        expiration_days = defaults.get('expiration_days')
+        return cls(
+            defaults=defaults,
+            title_prefix='Shopify Order' if title_prefix is None else title_prefix,
+            expiration_delta=timedelta(days=365 if expiration_days is None else expiration_days),
+            db_id=defaults.get('db_id') or DEFAULT_DB_ID,
+            status=defaults.get('status', 1),
+            shipper_id=defaults.get('shipper_id'),
+            sales_rep_id=defaults.get('sales_rep_id'),
+            term_id=defaults.get('term_id'),
+            customer_id=defaults.get('customer_id'),
+        )
+
 
 class QuotationConverter:
     """Converts Shopify orders to BackOffice quotations"""
@@ -28,7 +73,7 @@ class QuotationConverter:
         self.postgres = postgres_manager
 
     def convert_order(self, shopify_order: Dict, store_id: int,
-                     validated_products: List[Dict],
+                     validated_products: List[ValidatedProduct],
                      customer_id_override: Optional[int] = None) -> Dict:
         """
         Convert Shopify order to quotation
@@ -49,78 +94,87 @@ class QuotationConverter:
             }
         """
         try:
-            # Get store settings
-            defaults = self.postgres.get_quotation_defaults(store_id)
+            # Store settings (cached per store). With an override only the
+            # defaults row is needed; otherwise join in the customer mapping.
+            if customer_id_override:
+                defaults = self.postgres.get_quotation_defaults(store_id)
+            else:
+                defaults = self.postgres.get_store_conversion_context(store_id)
             if not defaults:
                 raise Exception("No quotation defaults configured for this store")
+            store_ctx = StoreContext.from_defaults(defaults)
 
             # Determine which customer_id to use
             if customer_id_override:
                 # Use custom customer ID if provided
                 customer_id = customer_id_override
-                logger.info(f"Using custom customer ID: {customer_id}")
+                logger.info("Using custom customer ID: %s", customer_id)
             else:
                 # Use default customer mapping
-                customer_mapping = self.postgres.get_customer_mapping(store_id)
-                if not customer_mapping:
+                customer_id = store_ctx.customer_id
+                if not customer_id:
                     raise Exception("No customer mapping configured for this store")
-                customer_id = customer_mapping['customer_id']
-                logger.info(f"Using default customer ID from mapping: {customer_id}")
+                logger.info("Using default customer ID from mapping: %s", customer_id)
 
-            # Get customer details from BackOffice
             customer = self.backoffice.get_customer_by_id(customer_id)
             if not customer:
                 raise Exception(f"Customer ID {customer_id} not found in BackOffice")
 
-            # Generate quotation number
-            db_id = defaults.get('db_id') or '1'
-            quotation_number = str(self.backoffice.get_next_quotation_number(db_id))
+            # One timestamp for the header and every line
+            now = datetime.now()
+            exp_date = now + DEFAULT_EXPIRATION
 
-            # Build quotation header
-            quotation_header = self._build_quotation_header(
-                shopify_order, customer, defaults, quotation_number
+            # Resolve unit descriptions for all distinct UnitIDs in one query
+            unit_desc_map = self.backoffice.get_unit_descriptions_bulk(
+                p.UnitID for p in validated_products
             )
 
-            # Calculate total from validated products
+            # Resolve quantity/price per line into compact arrays and total them.
+            # Line dicts are only built later, chunk by chunk, while inserting.
             # Convert to float to handle mixed float/Decimal types from different sources
-            quotation_total = sum(
-                (p.get('shopify_quantity') or 1) * float(p.get('shopify_price') or p.get('UnitPrice') or 0)
-                for p in validated_products
-            )
-            quotation_header['QuotationTotal'] = quotation_total
-
-            # Create quotation header
-            logger.info(f"Creating quotation header with number: {quotation_number}")
-            quotation_id = self.backoffice.create_quotation_header(quotation_header)
+            quantities = array('q')
+            prices = array('d')
+            quotation_total = 0.0
+            for product in validated_products:
+                quantity = product.shopify_quantity or 1
+                unit_price = float(product.shopify_price or product.UnitPrice or 0)
+                quantities.append(quantity)
+                prices.append(unit_price)
+                quotation_total += quantity * unit_price
 
-            if not quotation_id:
-                raise Exception("Failed to create quotation header")
+            # Build quotation header with the final total - inserted exactly once
+            quotation_header = self._build_quotation_header(
+                shopify_order, customer, store_ctx, now, quotation_total
+            )
 
-            logger.info(f"Created quotation ID: {quotation_id}")
+            # Header and lines share one transaction - a failed line insert
+            # rolls back the header instead of leaving an empty quotation. The
+            # quotation number is allocated by the header insert, under a lock
+            # held until this transaction commits
+            logger.info("Creating quotation for order %s", shopify_order.get('name'))
+            with self.backoffice.transaction():
+                quotation_id, quotation_number, line_items_created = self.backoffice.create_quotation_with_lines(
+                    quotation_header,
+                    self.backoffice.quotation_number_prefix(store_ctx.db_id),
+                    self._iter_quotation_lines(
+                        validated_products, customer, unit_desc_map, exp_date,
+                        quantities, prices
+                    )
+                )
 
-            # Create quotation line items
-            line_items_created = 0
-            for product in validated_products:
-                line_data = self._build_quotation_line(product, customer)
+                if not quotation_id:
+                    raise Exception("Failed to create quotation header")
 
-                try:
-                    line_id = self.backoffice.create_quotation_line(
-                        quotation_id, line_data
-                    )
-                    if line_id:
-                        line_items_created += 1
-                        logger.debug(f"Created line item {line_id} for product {product.get('ProductUPC')}")
-                    else:
-                        logger.warning(f"Failed to create line for product {product.get('ProductUPC')}")
+                logger.info("Created quotation %s (ID: %s)", quotation_number, quotation_id)
 
-                except Exception as line_error:
-                    logger.error(f"Error creating line for product {product.get('ProductUPC')}: {str(line_error)}")
-                    # Continue with other lines even if one fails
+                if line_items_created == 0:
+                    raise Exception("Failed to create any quotation line items")
 
-            if line_items_created == 0:
-                raise Exception("Failed to create any quotation line items")
+                # Rejected lines were skipped: the header total must match what was inserted
+                if line_items_created < len(validated_products):
+                    quotation_total = self.backoffice.update_quotation_total(quotation_id)
 
-            logger.info(f"Created {line_items_created} line items for quotation {quotation_number}")
+            logger.info("Created %s line items for quotation %s", line_items_created, quotation_number)
 
             return {
                 'quotation_id': quotation_id,
@@ -130,65 +184,64 @@ class QuotationConverter:
             }
 
         except Exception as e:
-            logger.error(f"Failed to convert order to quotation: {str(e)}")
+            logger.error("Failed to convert order to quotation: %s", e)
             raise
 
     def _build_quotation_header(self, shopify_order: Dict, customer: Dict,
-                                defaults: Dict, quotation_number: str) -> Dict:
-        """Build quotation header dict from Shopify order and settings"""
+                                store_ctx: StoreContext, now: datetime,
+                                quotation_total: float) -> Dict:
+        """Build quotation header dict from Shopify order and settings (number allocated on insert)"""
 
         # Get Shopify shipping address
-        ship_addr = shopify_order.get('shipping_address', {})
+        ship_addr = shopify_order.get('shipping_address') or {}
+        sg = ship_addr.get
+
+        # Recipient name, built once and used for both Shipto fallback and ShipContact
+        full_name = f"{sg('first_name') or ''} {sg('last_name') or ''}".strip()
+        ship_to = sg('company') or full_name
 
         # Build quotation title
-        title_prefix = defaults.get('quotation_title_prefix', 'Shopify Order')
-        quotation_title = f"{title_prefix} {shopify_order.get('name', '')}"
-        quotation_title = quotation_title[:50]  # Max length 50
+        # Max length 50 - trim the order name to fit instead of slicing the whole title
+        title_prefix = store_ctx.title_prefix
+        remaining = 50 - len(title_prefix) - 1
+        if remaining > 0:
+            quotation_title = f"{title_prefix} {(shopify_order.get('name') or '')[:remaining]}"
+        else:
+            quotation_title = title_prefix[:50]
 
         # Calculate dates
-        quotation_date = datetime.now()
-        expiration_days = defaults.get('expiration_days', 365)
-        expiration_date = quotation_date + timedelta(days=expiration_days)
-
-        # Truncate string fields to max length
-        def truncate(text, max_len):
-            return str(text or '')[:max_len] if text else None
+        quotation_date = now
+        expiration_date = quotation_date + store_ctx.expiration_delta
 
         return {
-            'QuotationNumber': quotation_number,
             'QuotationDate': quotation_date,
             'QuotationTitle': quotation_title,
-            'PoNumber': truncate(shopify_order.get('name'), 20),  # Use Shopify order name as PO
+            'PoNumber': _truncate(shopify_order.get('name'), 20),  # Use Shopify order name as PO
             'ExpirationDate': expiration_date,
 
             # Customer data from BackOffice
             'CustomerID': customer.get('CustomerID'),
-            'BusinessName': truncate(customer.get('BusinessName'), 50),
-            'AccountNo': truncate(customer.get('AccountNo'), 13),
+            'BusinessName': _truncate(customer.get('BusinessName'), 50),
+            'AccountNo': _truncate(customer.get('AccountNo'), 13),
 
             # Shipping address from Shopify
-            'Shipto': truncate(ship_addr.get('company') or
-                             f"{ship_addr.get('first_name', '')} {ship_addr.get('last_name', '')}".strip(),
-                             50),
-            'ShipAddress1': truncate(ship_addr.get('address1'), 50),
+            'Shipto': _truncate(ship_to, 50),
+            'ShipAddress1': _truncate(sg('address1'), 50),
             'ShipAddress2': '',  # Default to empty string
-            'ShipContact': truncate(
-                f"{ship_addr.get('first_name', '')} {ship_addr.get('last_name', '')}".strip(),
-                50
-            ),
-            'ShipCity': truncate(ship_addr.get('city'), 20),
-            'ShipState': truncate(ship_addr.get('province_code'), 3),
-            'ShipZipCode': truncate(ship_addr.get('zip'), 10),
+            'ShipContact': _truncate(full_name, 50),
+            'ShipCity': _truncate(sg('city'), 20),
+            'ShipState': _truncate(sg('province_code'), 3),
+            'ShipZipCode': _truncate(sg('zip'), 10),
             'ShipPhoneNo': '',  # Default to empty string
 
             # Defaults from settings (with customer overrides where applicable)
-            'Status': defaults.get('status', 1),
-            'ShipperID': defaults.get('shipper_id'),
-            'SalesRepID': customer.get('SalesRepID') or defaults.get('sales_rep_id'),  # Use customer's rep, fallback to default
-            'TermID': customer.get('TermID') or defaults.get('term_id'),  # Use customer's terms, fallback to default
+            'Status': store_ctx.status,
+            'ShipperID': store_ctx.shipper_id,
+            'SalesRepID': customer.get('SalesRepID') or store_ctx.sales_rep_id,  # Use customer's rep, fallback to default
+            'TermID': customer.get('TermID') or store_ctx.term_id,  # Use customer's terms, fallback to default
 
-            # Will be updated with calculated total
-            'QuotationTotal': 0,
+            # Sum of line ExtendedPrice values
+            'QuotationTotal': quotation_total,
 
             # Additional default fields
             'Header': '',
@@ -198,84 +251,76 @@ class QuotationConverter:
             'flaged': 0
         }
 
-    def _build_quotation_line(self, product: Dict, customer: Dict) -> Dict:
-        """Build quotation detail line from validated product"""
+    def _iter_quotation_lines(self, products: List[ValidatedProduct], customer: Dict,
+                              unit_desc_map: Dict[int, str], exp_date: datetime,
+                              quantities: array, prices: array) -> Iterator[tuple]:
+        """Lazily build quotation lines so the bulk insert holds one chunk at a time"""
+        for product, quantity, unit_price in zip(products, quantities, prices):
+            yield self._build_quotation_line_tuple(
+                product, customer, unit_desc_map, exp_date, quantity, unit_price
+            )
+
+    def _build_quotation_line_tuple(self, product: ValidatedProduct, customer: Dict,
+                                    unit_desc_map: Dict[int, str], exp_date: datetime,
+                                    quantity, unit_price: float) -> tuple:
+        """
+        Build quotation detail line from validated product (qty/price resolved by caller)
 
-        # Get unit description
-        unit_desc = None
-        if product.get('UnitID'):
-            unit_desc = self.backoffice.get_unit_description(product['UnitID'])
+        Returns values in QUOTATION_LINE_COLUMNS order, ready for the bulk
+        INSERT - no intermediate dict per line.
+        """
+
+        # Unit description preloaded by convert_order
+        unit_desc = unit_desc_map.get(product.UnitID)
 
         # Calculate prices - handle None values explicitly
         # Convert to float to handle mixed float/Decimal types from different sources
-        quantity = product.get('shopify_quantity') or 1
-        unit_price = float(product.get('shopify_price') or product.get('UnitPrice') or 0)
-        original_price = float(product.get('UnitPrice') or unit_price or 0)
-        unit_cost = float(product.get('UnitCost') or 0)
+        original_price = float(product.UnitPrice or unit_price or 0)
+        unit_cost = float(product.UnitCost or 0)
 
         extended_price = quantity * unit_price
         extended_cost = quantity * unit_cost
 
-        # Calculate expiration date (today + 1 year)
-        exp_date = datetime.now() + timedelta(days=365)
-
-        # Truncate string fields
-        def truncate(text, max_len):
-            return str(text or '')[:max_len] if text else None
-
-        return {
-            'CateID': product.get('CateID'),
-            'SubCateID': product.get('SubCateID'),
-            'UnitDesc': truncate(unit_desc, 50),
-            'UnitQty': 1,  # Default unit quantity
-
-            # Product identification
-            'ProductID': product.get('ProductID'),
-            'ProductSKU': truncate(product.get('ProductSKU'), 20),
-            'ProductUPC': truncate(product.get('ProductUPC'), 20),
-            'ProductDescription': truncate(
-                product.get('ProductDescription'),
-                50
-            ),
-            'ItemSize': '',  # Default to empty string
-
-            # Pricing
-            'UnitPrice': unit_price,
-            'OriginalPrice': original_price,
-            'UnitCost': unit_cost,
-            'Qty': quantity,
-
-            # Calculated
-            'ExtendedPrice': extended_price,
-            'ExtendedCost': extended_cost,
-
-            # Weight and tax
-            'ItemWeight': truncate(product.get('ItemWeight'), 10),
-            'Taxable': 0,  # Default to non-taxable
-            'ItemTaxID': product.get('ItemTaxID'),
-
-            # Additional fields
-            'ExpDate': exp_date,
-            'ReasonID': None,
-            'LineMessage': '',
-            'RememberPrice': 0,
-            'Discount': 0,
-            'ds_Percent': 0,
-            'ExtendedDisc': 0,
-            'PromotionID': None,
-            'PromotionLine': 0,
-            'PromotionDescription': '',
-            'PromotionAmount': 0,
-            'ActExtendedPrice': 0,
-            'SPPromoted': 0,
-            'SPPromotionDescription': '',
-            'Catch': None,
-            'Comments': '',
-            'Flag': 0
-        }
+        return (
+            product.CateID,                              # CateID
+            product.SubCateID,                           # SubCateID
+            _truncate(unit_desc, 50),                    # UnitDesc
+            1,                                           # UnitQty
+            product.ProductID,                           # ProductID
+            _truncate(product.ProductSKU, 20),           # ProductSKU
+            _truncate(product.ProductUPC, 20),           # ProductUPC
+            _truncate(product.ProductDescription, 50),   # ProductDescription
+            '',                                          # ItemSize
+            exp_date,                                    # ExpDate
+            None,                                        # ReasonID
+            '',                                          # LineMessage
+            unit_price,                                  # UnitPrice
+            original_price,                              # OriginalPrice
+            0,                                           # RememberPrice
+            unit_cost,                                   # UnitCost
+            0,                                           # Discount
+            0,                                           # ds_Percent
+            quantity,                                    # Qty
+            _truncate(product.ItemWeight, 10),           # ItemWeight
+            extended_price,                              # ExtendedPrice
+            0,                                           # ExtendedDisc
+            extended_cost,                               # ExtendedCost
+            None,                                        # PromotionID
+            0,                                           # PromotionLine
+            '',                                          # PromotionDescription
+            0,                                           # PromotionAmount
+            0,                                           # ActExtendedPrice
+            0,                                           # SPPromoted
+            '',                                          # SPPromotionDescription
+            0,                                           # Taxable (default non-taxable)
+            product.ItemTaxID,                           # ItemTaxID
+            None,                                        # Catch
+            '',                                          # Comments
+            0,                                           # Flag
+        )
 
     def create_quotation_with_transaction(self, shopify_order: Dict, store_id: int,
-                                        validated_products: List[Dict],
+                                        validated_products: List[ValidatedProduct],
                                         customer_id_override: Optional[int] = None) -> Dict:
         """
         Convert order to quotation with full error handling and transaction support
@@ -298,8 +343,8 @@ class QuotationConverter:
             result = self.convert_order(shopify_order, store_id, validated_products, customer_id_override)
 
             logger.info(
-                f"Successfully created quotation {result['quotation_number']} "
-                f"with {result['line_items_created']} line items"
+                "Successfully created quotation %s with %s line items",
+                result['quotation_number'], result['line_items_created']
             )
 
             return {
@@ -313,7 +358,7 @@ class QuotationConverter:
 
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"Quotation creation failed: {error_msg}")
+            logger.error("Quotation creation failed: %s", error_msg)
 
             return {
                 'success': False,
@@ -4,40 +4,311 @@ Handles all database operations with connection pooling and error handling
 """
 
 import os
+import time
+import base64
 import logging
-from typing import Optional, Dict, List, Any, Tuple
+import threading
+from functools import lru_cache
+from typing import Optional, Dict, List, Any, Tuple, Iterable, Set
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from collections import deque
+from itertools import chain, islice
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.extensions import connection as PGConnection
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 import pymssql
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 logger = logging.getLogger(__name__)
 
+# Seconds to keep settings rows (stores, SQL connections, quotation defaults, customer mapping) cached
+SETTINGS_CACHE_TTL = 60
+
+# SQL Server caps a single statement at 2100 parameters
+SQLSERVER_MAX_PARAMS = 2100
+
+# SQL Server errors for a line value that doesn't fit its column (arithmetic overflow,
+# date out of range, conversion failed, string truncation). pymssql raises most of
+# them as OperationalError; like constraint violations they only reject the bad line
+LINE_DATA_ERRORS = (220, 242, 245, 2628, 8114, 8115, 8152)
+
+
+@dataclass(slots=True)
+class TransferRow:
+    """One transfer history row, in get_transfer_history SELECT order"""
+    id: int
+    shopify_order_id: str
+    shopify_order_name: Optional[str]
+    quotation_number: Optional[str]
+    status: str
+    error_message: Optional[str]
+    line_items_count: Optional[int]
+    total_amount: Optional[Decimal]
+    transferred_at: datetime
+    store_name: str
+
+
+# Barcodes per IN (...) list in UPC lookups (padded up to 1024 parameters)
+UPC_LOOKUP_CHUNK_SIZE = 1000
+
+# SQL Server queries run off the request thread (speculative Inventory lookups,
+# extra chunks of large UPC lookups) share this pool. Its long-lived threads keep
+# their per-thread connections warm between requests
+SQLSERVER_LOOKUP_WORKERS = 4
+sqlserver_lookups = ThreadPoolExecutor(max_workers=SQLSERVER_LOOKUP_WORKERS,
+                                       thread_name_prefix='sqlserver-lookup')
+
+# Seconds an idle per-thread SQL Server connection is trusted before a SELECT 1 ping
+SQLSERVER_PING_INTERVAL = 30
+
+# Seconds an idle SQL Server connection is kept open before it is closed
+SQLSERVER_IDLE_TIMEOUT = 300
+
+# Seconds to wait for a SQL Server application lock (SQLServerManager.app_lock, quotation numbers)
+APP_LOCK_TIMEOUT = 60
+
+# Idle SQL Server connections, one per thread and connection settings:
+# {(thread_id, key): (connection, last_used_monotonic)}. A connection in use is
+# popped out, so any thread may close what is left here
+_idle_sqlserver_connections = {}
+_idle_sqlserver_connections_lock = threading.Lock()
+_last_idle_sweep = 0.0
+
+# One SQLServerManager per connection type, rebuilt when its settings change:
+# {connection_type: SQLServerManager}
+_sqlserver_managers = {}
+_sqlserver_managers_lock = threading.Lock()
+
+# Quotations_tbl insert columns with their defaults (REQUIRED: must be provided).
+# QuotationNumber is not among them: the insert batch allocates it
+REQUIRED = object()
+QUOTATION_HEADER_COLUMNS = (
+    ('QuotationDate', REQUIRED), ('QuotationTitle', REQUIRED),
+    ('PoNumber', None), ('AutoOrderNo', None), ('ExpirationDate', REQUIRED),
+    ('CustomerID', REQUIRED), ('BusinessName', REQUIRED), ('AccountNo', None),
+    ('Shipto', None), ('ShipAddress1', None), ('ShipAddress2', ''), ('ShipContact', None),
+    ('ShipCity', None), ('ShipState', None), ('ShipZipCode', None), ('ShipPhoneNo', ''),
+    ('Status', None), ('ShipperID', None), ('SalesRepID', None), ('TermID', None),
+    ('TotalTaxes', 0), ('QuotationTotal', 0),
+    ('Header', ''), ('Footer', ''), ('Notes', ''), ('Memo', ''), ('flaged', 0)
+)
+
+# QuotationsDetails_tbl insert columns (after QuotationID) with their defaults
+QUOTATION_LINE_COLUMNS = (
+    ('CateID', None), ('SubCateID', None), ('UnitDesc', None), ('UnitQty', 1),
+    ('ProductID', None), ('ProductSKU', None), ('ProductUPC', None),
+    ('ProductDescription', None), ('ItemSize', ''),
+    ('ExpDate', None), ('ReasonID', None), ('LineMessage', ''),
+    ('UnitPrice', None), ('OriginalPrice', None), ('RememberPrice', 0), ('UnitCost', None),
+    ('Discount', 0), ('ds_Percent', 0), ('Qty', None), ('ItemWeight', None),
+    ('ExtendedPrice', None), ('ExtendedDisc', 0), ('ExtendedCost', None),
+    ('PromotionID', None), ('PromotionLine', 0), ('PromotionDescription', ''), ('PromotionAmount', 0),
+    ('ActExtendedPrice', 0), ('SPPromoted', 0), ('SPPromotionDescription', ''),
+    ('Taxable', 0), ('ItemTaxID', None), ('Catch', None), ('Comments', ''), ('Flag', 0)
+)
+QUOTATION_LINE_COLUMN_NAMES = tuple(col for col, _ in QUOTATION_LINE_COLUMNS)
+
+# Items_tbl columns copied from Inventory to BackOffice, with their defaults
+ITEM_COPY_COLUMNS = (
+    ('CateID', None), ('SubCateID', None), ('ProductSKU', None), ('ProductUPC', None),
+    ('ProductDescription', None), ('UnitPrice', None), ('UnitCost', None),
+    ('ItemSize', None), ('ItemWeight', None), ('UnitID', None), ('ItemTaxID', None),
+    ('SPPromoted', 0)  # Not present in Inventory
+)
+ITEM_COPY_COLUMN_NAMES = tuple(col for col, _ in ITEM_COPY_COLUMNS)
+
+
+class PreparingConnection(PGConnection):
+    """psycopg2 connection that remembers which statements it has PREPAREd"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def _build_update_sql(table: str, columns: Tuple[str, ...]) -> Dict[int, str]:
+    """
+    Pre-build UPDATE statements for every non-empty subset of columns, keyed by
+    a bitmask where bit i means columns[i] is being set
+    """
+    statements = {}
+    for mask in range(1, 1 << len(columns)):
+        assignments = ', '.join(f"{col} = %s" for i, col in enumerate(columns) if mask >> i & 1)
+        statements[mask] = f"UPDATE {table} SET {assignments} WHERE id = %s"
+    return statements
+
+
+def _update_mask(values: tuple) -> int:
+    """Bitmask of the values that are not None"""
+    return sum(1 << i for i, value in enumerate(values) if value is not None)
+
+
+STORE_UPDATE_SQL = _build_update_sql('shopify_stores', ('name', 'shop_url', 'admin_api_token'))
+TRANSFER_UPDATE_SQL = _build_update_sql('transfer_history', ('quotation_number', 'status', 'error_message'))
+
+
+class FairSlots:
+    """
+    Counting gate that hands freed slots to waiters strictly first-come,
+    first-served. A released slot goes straight to the oldest waiter, so a
+    thread that just returned a connection cannot barge ahead of the queue.
+    """
+
+    def __init__(self, size: int):
+        self._free = size
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        if waiter.wait(timeout):
+            return True
+
+        with self._lock:
+            # A slot may have been handed over right as the wait timed out
+            if waiter.is_set():
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._free += 1
+
+
+def _to_positional(query: str) -> str:
+    """Rewrite %s placeholders as $1, $2, ... for PREPARE"""
+    parts = query.split('%s')
+    return ''.join(
+        part + (f'${i}' if i < len(parts) else '')
+        for i, part in enumerate(parts, start=1)
+    )
+
+
+def _is_bad_line(error: Exception) -> bool:
+    """True for a pymssql error caused by the values inserted, not the connection"""
+    if isinstance(error, (pymssql.IntegrityError, pymssql.DataError)):
+        return True
+    return (isinstance(error, pymssql.OperationalError)
+            and bool(error.args) and error.args[0] in LINE_DATA_ERRORS)
+
+
+def _padded_size(count: int) -> int:
+    """Round an IN-list length up to a power of two (few distinct statement shapes)"""
+    return 1 << (count - 1).bit_length()
+
+
+@lru_cache(maxsize=None)
+def _upc_lookup_sql(size: int) -> str:
+    """
+    Items_tbl lookup for exactly `size` barcodes through sp_executesql
+
+    pymssql interpolates parameters client-side, so a plain IN (...) reaches
+    SQL Server as a new ad hoc statement for every barcode list. Passing them as
+    real sp_executesql parameters lets the server reuse one plan per size.
+    """
+    names = ', '.join(f'@p{i}' for i in range(size))
+    declarations = ', '.join(f'@p{i} VARCHAR(255)' for i in range(size))
+    assignments = ', '.join(f'@p{i} = %s' for i in range(size))
+    return (
+        "EXEC sp_executesql N'"
+        "SELECT ProductID, CateID, SubCateID, ProductSKU, ProductUPC, "
+        "ProductDescription, UnitPrice, UnitCost, ItemSize, ItemWeight, UnitID, ItemTaxID "
+        f"FROM dbo.Items_tbl WHERE ProductUPC IN ({names})', "
+        f"N'{declarations}', {assignments}"
+    )
+
+
+# Prefix marking passwords stored as ChaCha20-Poly1305 (nonce || ciphertext);
+# anything without it is a legacy Fernet token
+AEAD_TOKEN_PREFIX = 'v2:'
+AEAD_NONCE_SIZE = 12
+
+
+@lru_cache(maxsize=None)
+def get_encryption_key() -> bytes:
+    """Resolve ENCRYPTION_KEY (a Fernet key) once per process"""
+    key = os.getenv('ENCRYPTION_KEY')
+    if key is None:
+        # Passwords encrypted with a generated key are unreadable after a restart
+        logger.warning("ENCRYPTION_KEY not set, using a temporary key for this process")
+        key = Fernet.generate_key()
+    if isinstance(key, str):
+        key = key.encode()
+    return key
+
+
+@lru_cache(maxsize=None)
+def get_cipher() -> Fernet:
+    """Process-wide Fernet cipher, kept to read passwords stored before AEAD"""
+    return Fernet(get_encryption_key())
+
+
+@lru_cache(maxsize=None)
+def get_aead() -> ChaCha20Poly1305:
+    """Process-wide ChaCha20-Poly1305 cipher with a key derived from ENCRYPTION_KEY"""
+    key = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'shopify-quotation sql_connections password'
+    ).derive(base64.urlsafe_b64decode(get_encryption_key()))
+    return ChaCha20Poly1305(key)
+
 
 class EncryptionManager:
     """Handles encryption/decryption of sensitive data like passwords"""
 
     def __init__(self):
-        # Generate or load encryption key
-        self.key = os.getenv('ENCRYPTION_KEY', Fernet.generate_key())
-        if isinstance(self.key, str):
-            self.key = self.key.encode()
-        self.cipher = Fernet(self.key)
+        self.cipher = get_cipher()
+        self.aead = get_aead()
 
     def encrypt(self, text: str) -> str:
-        """Encrypt text and return base64 encoded string"""
+        """Encrypt text and return a prefixed base64 encoded string"""
         if not text:
             return ""
-        return self.cipher.encrypt(text.encode()).decode()
+        nonce = os.urandom(AEAD_NONCE_SIZE)
+        token = nonce + self.aead.encrypt(nonce, text.encode(), None)
+        return AEAD_TOKEN_PREFIX + base64.urlsafe_b64encode(token).decode()
 
     def decrypt(self, encrypted_text: str) -> str:
-        """Decrypt base64 encoded string"""
+        """Decrypt a string produced by encrypt() or a legacy Fernet token"""
         if not encrypted_text:
             return ""
+        if not self.is_legacy(encrypted_text):
+            token = base64.urlsafe_b64decode(encrypted_text[len(AEAD_TOKEN_PREFIX):])
+            nonce, ciphertext = token[:AEAD_NONCE_SIZE], token[AEAD_NONCE_SIZE:]
+            return self.aead.decrypt(nonce, ciphertext, None).decode()
         return self.cipher.decrypt(encrypted_text.encode()).decode()
 
+    @staticmethod
+    def is_legacy(encrypted_text: str) -> bool:
+        """True for passwords still stored as Fernet tokens"""
+        return bool(encrypted_text) and not encrypted_text.startswith(AEAD_TOKEN_PREFIX)
+
+
+@lru_cache(maxsize=None)
+def get_encryption() -> EncryptionManager:
+    """Process-wide EncryptionManager shared by every PostgreSQLManager"""
+    return EncryptionManager()
+
 
 class PostgreSQLManager:
     """Manages PostgreSQL connection pool and operations"""
@@ -48,30 +319,52 @@ class PostgreSQLManager:
         self.database = os.getenv('POSTGRES_DB', 'shopify_quotation')
         self.user = os.getenv('POSTGRES_USER', 'admin')
         self.password = os.getenv('POSTGRES_PASSWORD', 'admin123')
-        self.pool: Optional[SimpleConnectionPool] = None
-        self.encryption = EncryptionManager()
+        # Pool bounds: PG_POOL_MAX must stay below PostgreSQL's max_connections
+        # minus superuser_reserved_connections, across all app workers combined
+        self.pool_min = int(os.getenv('PG_POOL_MIN', 5))
+        self.pool_max = int(os.getenv('PG_POOL_MAX', 25))
+        # Seconds a request waits for a free connection before giving up
+        self.pool_timeout = float(os.getenv('PG_POOL_TIMEOUT', 30))
+        self.pool: Optional[ThreadedConnectionPool] = None
+        # ThreadedConnectionPool raises immediately when exhausted; gate checkout
+        # so request bursts queue (in arrival order) for a free slot instead of failing
+        self._pool_slots = FairSlots(self.pool_max)
+        self.encryption = get_encryption()
+        self._settings_cache: Dict[tuple, Tuple[float, Any]] = {}
+        self._settings_cache_lock = threading.Lock()
         self._initialize_pool()
 
     def _initialize_pool(self):
-        """Initialize connection pool"""
+        """Initialize thread-safe connection pool (Flask serves requests on threads)"""
         try:
-            self.pool = SimpleConnectionPool(
-                minconn=2,
-                maxconn=10,
+            self.pool = ThreadedConnectionPool(
+                minconn=self.pool_min,
+                maxconn=self.pool_max,
                 host=self.host,
                 port=self.port,
                 database=self.database,
                 user=self.user,
-                password=self.password
+                password=self.password,
+                connection_factory=PreparingConnection
             )
-            logger.info("PostgreSQL connection pool initialized")
+            logger.info(f"PostgreSQL connection pool initialized ({self.pool_min}-{self.pool_max} connections)")
         except Exception as e:
             logger.error(f"Failed to initialize PostgreSQL pool: {str(e)}")
             raise
 
+    def close(self):
+        """Close all pooled connections (call on shutdown)"""
+        if self.pool:
+            self.pool.closeall()
+            logger.info("PostgreSQL connection pool closed")
+
     @contextmanager
     def get_connection(self):
         """Context manager for database connections"""
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            raise PoolError(
+                f"Timed out after {self.pool_timeout}s waiting for a PostgreSQL connection"
+            )
         conn = None
         try:
             conn = self.pool.getconn()
@@ -85,13 +378,38 @@ class PostgreSQLManager:
         finally:
             if conn:
                 self.pool.putconn(conn)
+            self._pool_slots.release()
 
-    def execute_query(self, query: str, params: tuple = None) -> List[Dict]:
-        """Execute SELECT query and return results as list of dicts"""
+    def execute_query(self, query: str, params: tuple = None,
+                      name: Optional[str] = None) -> List[Dict]:
+        """
+        Execute SELECT query and return results as list of dicts
+
+        When name is given the query is PREPAREd once per pooled connection and
+        run with EXECUTE afterwards, skipping the parse/plan on hot lookups.
+        """
         with self.get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                if name is None:
+                    cursor.execute(query, params or ())
+                    return cursor.fetchall()
+
+                if name not in conn.prepared:
+                    cursor.execute(f"PREPARE {name} AS {_to_positional(query)}")
+                    conn.prepared.add(name)
+                if params:
+                    placeholders = ', '.join(['%s'] * len(params))
+                    cursor.execute(f"EXECUTE {name}({placeholders})", params)
+                else:
+                    cursor.execute(f"EXECUTE {name}")
+                return cursor.fetchall()
+
+    def execute_query_rows(self, query: str, params: tuple, row_cls: type) -> List[Any]:
+        """Execute SELECT query and build one row_cls per row from its column values"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute(query, params or ())
-                return [dict(row) for row in cursor.fetchall()]
+                return [row_cls(*row) for row in cursor.fetchall()]
 
     def execute_insert(self, query: str, params: tuple = None) -> int:
         """Execute INSERT query and return inserted ID"""
@@ -107,6 +425,27 @@ class PostgreSQLManager:
                 cursor.execute(query, params or ())
                 return cursor.rowcount
 
+    def _cached_settings(self, key: tuple, loader):
+        """Return loader() result, cached per key for SETTINGS_CACHE_TTL seconds"""
+        now = time.monotonic()
+        entry = self._settings_cache.get(key)
+        if entry is None or now - entry[0] >= SETTINGS_CACHE_TTL:
+            entry = (now, loader())
+            with self._settings_cache_lock:
+                self._settings_cache[key] = entry
+        value = entry[1]
+        # Hand out copies so callers can't mutate the cached row
+        return dict(value) if value is not None else None
+
+    def invalidate_settings(self, owner):
+        """
+        Drop cached rows for a store id (store, defaults, mapping) or a SQL
+        connection type after they change
+        """
+        with self._settings_cache_lock:
+            for key in [k for k in self._settings_cache if k[1] == owner]:
+                del self._settings_cache[key]
+
     # ========================================================================
     # Shopify Stores CRUD
     # ========================================================================
@@ -124,15 +463,18 @@ class PostgreSQLManager:
         return self.execute_query(query)
 
     def get_shopify_store(self, store_id: int) -> Optional[Dict]:
-        """Get single Shopify store by ID"""
+        """Get single Shopify store by ID (cached, see SETTINGS_CACHE_TTL)"""
         query = """
             SELECT id, name, shop_url, admin_api_token, is_active,
                    created_at, updated_at
             FROM shopify_stores
             WHERE id = %s
         """
-        results = self.execute_query(query, (store_id,))
-        return results[0] if results else None
+        def load():
+            results = self.execute_query(query, (store_id,), name='stmt_get_shopify_store')
+            return results[0] if results else None
+
+        return self._cached_settings(('shopify_store', store_id), load)
 
     def create_shopify_store(self, name: str, shop_url: str, api_token: str) -> int:
         """Create new Shopify store"""
@@ -146,34 +488,22 @@ class PostgreSQLManager:
     def update_shopify_store(self, store_id: int, name: str = None,
                             shop_url: str = None, api_token: str = None) -> int:
         """Update Shopify store"""
-        updates = []
-        params = []
-
-        if name is not None:
-            updates.append("name = %s")
-            params.append(name)
-        if shop_url is not None:
-            updates.append("shop_url = %s")
-            params.append(shop_url)
-        if api_token is not None:
-            updates.append("admin_api_token = %s")
-            params.append(api_token)
-
-        if not updates:
+        values = (name, shop_url, api_token)
+        mask = _update_mask(values)
+        if not mask:
             return 0
 
-        params.append(store_id)
-        query = f"""
-            UPDATE shopify_stores
-            SET {', '.join(updates)}
-            WHERE id = %s
-        """
-        return self.execute_update(query, tuple(params))
+        params = tuple(value for value in values if value is not None) + (store_id,)
+        affected = self.execute_update(STORE_UPDATE_SQL[mask], params)
+        self.invalidate_settings(store_id)
+        return affected
 
     def delete_shopify_store(self, store_id: int) -> int:
         """Delete Shopify store"""
         query = "DELETE FROM shopify_stores WHERE id = %s"
-        return self.execute_update(query, (store_id,))
+        affected = self.execute_update(query, (store_id,))
+        self.invalidate_settings(store_id)
+        return affected
 
     # ========================================================================
     # SQL Connections CRUD
@@ -188,17 +518,21 @@ class PostgreSQLManager:
             FROM sql_connections
             ORDER BY connection_type
         """
-        results = self.execute_query(query)
+        return self._decrypt_password_field(self.execute_query(query))
 
-        # Decrypt passwords
-        for row in results:
-            row['password'] = self.encryption.decrypt(row['password_encrypted'])
-            del row['password_encrypted']
-
-        return results
+    def get_sql_connections_public(self) -> List[Dict]:
+        """Get all SQL connections without the password column (safe to return to clients)"""
+        query = """
+            SELECT id, connection_type, host, port, database_name,
+                   username, is_active,
+                   created_at, updated_at
+            FROM sql_connections
+            ORDER BY connection_type
+        """
+        return self.execute_query(query)
 
     def get_sql_connection(self, connection_type: str) -> Optional[Dict]:
-        """Get SQL connection by type (backoffice or inventory)"""
+        """Get SQL connection by type (backoffice or inventory), cached like store settings"""
         query = """
             SELECT id, connection_type, host, port, database_name,
                    username, password_encrypted, is_active,
@@ -206,13 +540,50 @@ class PostgreSQLManager:
             FROM sql_connections
             WHERE connection_type = %s
         """
-        results = self.execute_query(query, (connection_type,))
-        if results:
-            result = results[0]
-            result['password'] = self.encryption.decrypt(result['password_encrypted'])
-            del result['password_encrypted']
-            return result
-        return None
+        def load():
+            results = self._decrypt_password_field(self.execute_query(query, (connection_type,)))
+            return results[0] if results else None
+
+        return self._cached_settings(('sql_connection', connection_type), load)
+
+    def _decrypt_password_field(self, rows: List[Dict]) -> List[Dict]:
+        """Replace password_encrypted with the decrypted password, in place"""
+        decrypt = self.encryption.decrypt
+        for row in rows:
+            row['password'] = decrypt(row.pop('password_encrypted', None))
+        return rows
+
+    def reencrypt_legacy_passwords(self) -> int:
+        """
+        Store passwords still kept as legacy Fernet tokens in the current (AEAD)
+        format. One-off: see migrations/reencrypt_sql_passwords.py
+
+        Returns:
+            Number of passwords re-encrypted
+        """
+        rows = self.execute_query("SELECT id, password_encrypted FROM sql_connections")
+        encryption = self.encryption
+        updates = [
+            (row['id'], encryption.encrypt(encryption.decrypt(row['password_encrypted'])))
+            for row in rows if encryption.is_legacy(row['password_encrypted'])
+        ]
+        if not updates:
+            return 0
+
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    """
+                    UPDATE sql_connections AS c
+                    SET password_encrypted = v.password_encrypted
+                    FROM (VALUES %s) AS v(id, password_encrypted)
+                    WHERE c.id = v.id
+                    """,
+                    updates
+                )
+        logger.info(f"Re-encrypted {len(updates)} SQL connection password(s)")
+        return len(updates)
 
     def upsert_sql_connection(self, connection_type: str, host: str, port: int,
                              database_name: str, username: str, password: str) -> int:
@@ -233,24 +604,30 @@ class PostgreSQLManager:
                 updated_at = CURRENT_TIMESTAMP
             RETURNING id
         """
-        return self.execute_insert(query, (
+        conn_id = self.execute_insert(query, (
             connection_type, host, port, database_name, username, encrypted_password
         ))
+        self.invalidate_settings(connection_type)
+        return conn_id
 
     # ========================================================================
     # Customer Mappings CRUD
     # ========================================================================
 
     def get_customer_mapping(self, store_id: int) -> Optional[Dict]:
-        """Get customer mapping for store"""
+        """Get customer mapping for store (cached, see SETTINGS_CACHE_TTL)"""
         query = """
             SELECT id, shopify_store_id, customer_id, business_name,
                    created_at, updated_at
             FROM customer_mappings
             WHERE shopify_store_id = %s
         """
-        results = self.execute_query(query, (store_id,))
-        return results[0] if results else None
+
+        def load():
+            results = self.execute_query(query, (store_id,))
+            return results[0] if results else None
+
+        return self._cached_settings(('customer_mapping', store_id), load)
 
     def upsert_customer_mapping(self, store_id: int, customer_id: int,
                                 business_name: str = None) -> int:
@@ -266,14 +643,16 @@ class PostgreSQLManager:
                 updated_at = CURRENT_TIMESTAMP
             RETURNING id
         """
-        return self.execute_insert(query, (store_id, customer_id, business_name))
+        mapping_id = self.execute_insert(query, (store_id, customer_id, business_name))
+        self.invalidate_settings(store_id)
+        return mapping_id
 
     # ========================================================================
     # Quotation Defaults CRUD
     # ========================================================================
 
     def get_quotation_defaults(self, store_id: int) -> Optional[Dict]:
-        """Get quotation defaults for store"""
+        """Get quotation defaults for store (cached, see SETTINGS_CACHE_TTL)"""
         query = """
             SELECT id, shopify_store_id, status, shipper_id, sales_rep_id,
                    term_id, quotation_title_prefix, expiration_days, db_id,
@@ -281,8 +660,43 @@ class PostgreSQLManager:
             FROM quotation_defaults
             WHERE shopify_store_id = %s
         """
-        results = self.execute_query(query, (store_id,))
-        return results[0] if results else None
+
+        def load():
+            results = self.execute_query(query, (store_id,))
+            return results[0] if results else None
+
+        return self._cached_settings(('quotation_defaults', store_id), load)
+
+    def get_store_conversion_context(self, store_id: int) -> Optional[Dict]:
+        """
+        Get quotation defaults joined with the store's customer mapping
+
+        One round trip for everything convert_order needs from PostgreSQL,
+        cached per store like the individual settings getters. Callers that
+        already have a customer override should use get_quotation_defaults()
+        instead and skip the join.
+
+        Args:
+            store_id: Shopify store ID
+
+        Returns:
+            Defaults dict with an extra 'customer_id' key (None when no
+            mapping exists), or None if the store has no defaults configured
+        """
+        query = """
+            SELECT d.id, d.shopify_store_id, d.status, d.shipper_id, d.sales_rep_id,
+                   d.term_id, d.quotation_title_prefix, d.expiration_days, d.db_id,
+                   d.created_at, d.updated_at, m.customer_id
+            FROM quotation_defaults d
+            LEFT JOIN customer_mappings m ON m.shopify_store_id = d.shopify_store_id
+            WHERE d.shopify_store_id = %s
+        """
+
+        def load():
+            results = self.execute_query(query, (store_id,))
+            return results[0] if results else None
+
+        return self._cached_settings(('conversion_context', store_id), load)
 
     def upsert_quotation_defaults(self, store_id: int, status: int = None,
                                   shipper_id: int = None, sales_rep_id: int = None,
@@ -306,10 +720,12 @@ class PostgreSQLManager:
                 updated_at = CURRENT_TIMESTAMP
             RETURNING id
         """
-        return self.execute_insert(query, (
+        defaults_id = self.execute_insert(query, (
             store_id, status, shipper_id, sales_rep_id, term_id,
             quotation_title_prefix, expiration_days, db_id
         ))
+        self.invalidate_settings(store_id)
+        return defaults_id
 
     # ========================================================================
     # Transfer History CRUD
@@ -320,49 +736,60 @@ class PostgreSQLManager:
                               error_message: str = None, line_items_count: int = 0,
                               total_amount: float = 0.0) -> int:
         """Create transfer history record"""
+        return self.create_transfer_records_bulk([{
+            'store_id': store_id,
+            'order_id': order_id,
+            'order_name': order_name,
+            'quotation_number': quotation_number,
+            'status': status,
+            'error_message': error_message,
+            'line_items_count': line_items_count,
+            'total_amount': total_amount
+        }])[0]
+
+    def create_transfer_records_bulk(self, records: List[Dict]) -> List[int]:
+        """
+        Create transfer history records in a single multi-row INSERT
+
+        Each record uses the create_transfer_record argument names as keys.
+        Returns the new ids in record order.
+        """
+        if not records:
+            return []
+
+        rows = [(
+            r['store_id'], r['order_id'], r['order_name'],
+            r.get('quotation_number'), r.get('status', 'pending'), r.get('error_message'),
+            r.get('line_items_count', 0), r.get('total_amount', 0.0)
+        ) for r in records]
+
         query = """
             INSERT INTO transfer_history
                 (shopify_store_id, shopify_order_id, shopify_order_name,
                  quotation_number, status, error_message, line_items_count, total_amount)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            VALUES %s
             RETURNING id
         """
-        return self.execute_insert(query, (
-            store_id, order_id, order_name, quotation_number, status,
-            error_message, line_items_count, total_amount
-        ))
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                results = execute_values(cursor, query, rows, page_size=500, fetch=True)
+                return [row[0] for row in results]
 
     def update_transfer_record(self, transfer_id: int, quotation_number: str = None,
                               status: str = None, error_message: str = None) -> int:
         """Update transfer history record"""
-        updates = []
-        params = []
-
-        if quotation_number is not None:
-            updates.append("quotation_number = %s")
-            params.append(quotation_number)
-        if status is not None:
-            updates.append("status = %s")
-            params.append(status)
-        if error_message is not None:
-            updates.append("error_message = %s")
-            params.append(error_message)
-
-        if not updates:
+        values = (quotation_number, status, error_message)
+        mask = _update_mask(values)
+        if not mask:
             return 0
 
-        params.append(transfer_id)
-        query = f"""
-            UPDATE transfer_history
-            SET {', '.join(updates)}
-            WHERE id = %s
-        """
-        return self.execute_update(query, tuple(params))
+        params = tuple(value for value in values if value is not None) + (transfer_id,)
+        return self.execute_update(TRANSFER_UPDATE_SQL[mask], params)
 
-    def get_transfer_history(self, store_id: int = None, status: str = None,
-                            start_date: str = None, end_date: str = None,
-                            limit: int = 100, offset: int = 0) -> List[Dict]:
-        """Get transfer history with filters"""
+    def _transfer_history_query(self, store_id: int = None, status: str = None,
+                                start_date: str = None, end_date: str = None,
+                                before: Optional[Tuple[Any, int]] = None) -> Tuple[str, List]:
+        """Build the filtered, newest-first transfer history SELECT and its params"""
         conditions = []
         params = []
 
@@ -378,6 +805,9 @@ class PostgreSQLManager:
         if end_date is not None:
             conditions.append("transferred_at <= %s")
             params.append(end_date)
+        if before is not None:
+            conditions.append("(h.transferred_at, h.id) < (%s, %s)")
+            params.extend(before)
 
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
@@ -388,11 +818,29 @@ class PostgreSQLManager:
             FROM transfer_history h
             JOIN shopify_stores s ON h.shopify_store_id = s.id
             {where_clause}
-            ORDER BY h.transferred_at DESC
-            LIMIT %s OFFSET %s
+            ORDER BY h.transferred_at DESC, h.id DESC
+        """
+        return query, params
+
+    def get_transfer_history(self, store_id: int = None, status: str = None,
+                            start_date: str = None, end_date: str = None,
+                            limit: int = 100, offset: int = 0,
+                            before: Optional[Tuple[Any, int]] = None) -> List[TransferRow]:
+        """
+        Get transfer history with filters, newest first
+
+        Pass before=(transferred_at, id) of the last row already shown to fetch the
+        next page by keyset, so deep pages don't rescan skipped rows. offset is
+        deprecated (kept for API clients still paging with ?offset=) and ignored
+        when before is given.
         """
-        params.extend([limit, offset])
-        return self.execute_query(query, tuple(params))
+        query, params = self._transfer_history_query(store_id, status, start_date, end_date, before)
+        query += " LIMIT %s"
+        params.append(limit)
+        if before is None and offset:
+            query += " OFFSET %s"
+            params.append(offset)
+        return self.execute_query_rows(query, tuple(params), TransferRow)
 
     def delete_transfer_record(self, transfer_id: int) -> int:
         """Delete single transfer record"""
@@ -413,13 +861,30 @@ class PostgreSQLManager:
     def check_order_transferred(self, store_id: int, order_id: str) -> bool:
         """Check if order has been successfully transferred"""
         query = """
-            SELECT COUNT(*) FROM transfer_history
+            SELECT EXISTS(
+                SELECT 1 FROM transfer_history
+                WHERE shopify_store_id = %s
+                AND shopify_order_id = %s
+                AND status = 'success'
+            ) AS transferred
+        """
+        result = self.execute_query(query, (store_id, order_id), name='stmt_check_order_transferred')
+        return bool(result[0]['transferred']) if result else False
+
+    def check_orders_transferred(self, store_id: int, order_ids: Iterable) -> Set[str]:
+        """Return the subset of order_ids that have been successfully transferred"""
+        order_ids = [str(order_id) for order_id in order_ids]
+        if not order_ids:
+            return set()
+
+        query = """
+            SELECT shopify_order_id FROM transfer_history
             WHERE shopify_store_id = %s
-            AND shopify_order_id = %s
+            AND shopify_order_id = ANY(%s)
             AND status = 'success'
         """
-        result = self.execute_query(query, (store_id, order_id))
-        return result[0]['count'] > 0 if result else False
+        results = self.execute_query(query, (store_id, order_ids))
+        return {row['shopify_order_id'] for row in results}
 
 
 class SQLServerManager:
@@ -432,35 +897,167 @@ class SQLServerManager:
         self.username = connection_config['username']
         self.password = connection_config['password']
         self.connection_type = connection_config['connection_type']
+        # Connections of the transaction() and app_lock() open on the current thread, if any
+        self._tx = threading.local()
+
+    @property
+    def settings(self) -> tuple:
+        return (self.host, self.port, self.database, self.username, self.password)
+
+    def _connection_key(self, read_only: bool) -> tuple:
+        return self.settings + (read_only,)
+
+    def _connect(self, read_only: bool):
+        return pymssql.connect(
+            server=self.host,
+            port=self.port,
+            user=self.username,
+            password=self.password,
+            database=self.database,
+            timeout=10,
+            login_timeout=10,
+            autocommit=read_only
+        )
+
+    def _acquire_connection(self, read_only: bool):
+        """
+        Return this thread's open connection for these settings, reconnecting when
+        it has been idle past SQLSERVER_PING_INTERVAL and no longer answers
+        """
+        slot = (threading.get_ident(), self._connection_key(read_only))
+        with _idle_sqlserver_connections_lock:
+            cached = _idle_sqlserver_connections.pop(slot, None)
+        if cached is not None:
+            conn, last_used = cached
+            if time.monotonic() - last_used < SQLSERVER_PING_INTERVAL:
+                return conn
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                return conn
+            except Exception:
+                logger.info(f"Reconnecting stale SQL Server connection ({self.connection_type})")
+                self._close_quietly(conn)
+
+        return self._connect(read_only)
+
+    def _release_connection(self, conn, read_only: bool):
+        """
+        Keep a healthy connection for the next call on this thread, and close
+        connections left idle past SQLSERVER_IDLE_TIMEOUT
+        """
+        global _last_idle_sweep
+        now = time.monotonic()
+        slot = (threading.get_ident(), self._connection_key(read_only))
+        with _idle_sqlserver_connections_lock:
+            # A nested get_connection on this thread released one here already
+            displaced = _idle_sqlserver_connections.get(slot)
+            _idle_sqlserver_connections[slot] = (conn, now)
+        if displaced is not None:
+            self._close_quietly(displaced[0])
+
+        if now - _last_idle_sweep >= SQLSERVER_PING_INTERVAL:
+            _last_idle_sweep = now
+            close_sqlserver_connections(idle_for=SQLSERVER_IDLE_TIMEOUT)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
 
     @contextmanager
-    def get_connection(self):
-        """Context manager for SQL Server connections"""
+    def get_connection(self, read_only: bool = False):
+        """
+        Context manager for SQL Server connections
+
+        Connections are kept open per thread and reused across calls (and across
+        manager instances with the same settings) to skip the TDS login each time,
+        until idle for SQLSERVER_IDLE_TIMEOUT.
+        read_only=True hands out a separate autocommit connection for SELECTs:
+        no implicit transaction is opened, so there is no COMMIT round trip.
+        """
+        # Inside transaction(): reuse its connection, commit happens there.
+        # Inside app_lock(): reads reuse the autocommit connection holding the lock
+        tx_conn = getattr(self._tx, 'conn', None)
+        if tx_conn is None and read_only:
+            tx_conn = getattr(self._tx, 'lock_conn', None)
+        if tx_conn is not None:
+            yield tx_conn
+            return
+
         conn = None
         try:
-            conn = pymssql.connect(
-                server=self.host,
-                port=self.port,
-                user=self.username,
-                password=self.password,
-                database=self.database,
-                timeout=10,
-                login_timeout=10
-            )
+            conn = self._acquire_connection(read_only)
             yield conn
-            conn.commit()
+            if not read_only:
+                conn.commit()
         except Exception as e:
-            if conn:
-                conn.rollback()
+            if conn and read_only:
+                # Nothing to roll back; reconnect next time in case the link broke
+                self._close_quietly(conn)
+                conn = None
+            elif conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    # Connection is unusable, don't hand it out again
+                    self._close_quietly(conn)
+                    conn = None
             logger.error(f"SQL Server error ({self.connection_type}): {str(e)}")
             raise
         finally:
             if conn:
-                conn.close()
+                self._release_connection(conn, read_only)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run several statements on one connection as a single transaction.
+        Commits on exit, rolls everything back if any statement fails.
+        """
+        with self.get_connection() as conn:
+            self._tx.conn = conn
+            try:
+                yield conn
+            finally:
+                self._tx.conn = None
+
+    @contextmanager
+    def app_lock(self, resource: str, timeout: float = APP_LOCK_TIMEOUT):
+        """
+        Hold an exclusive SQL Server application lock (sp_getapplock) while the block runs
+
+        Serializes a step across every thread and Gunicorn worker (and any other
+        client taking the same lock). The lock is owned by the session of this
+        thread's autocommit read connection, so statements inside the block commit
+        as usual; a dropped connection releases it. Reads inside the block run on
+        that same connection instead of opening another.
+        """
+        with self.get_connection(read_only=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DECLARE @result INT;
+                EXEC @result = sp_getapplock @Resource = %s, @LockMode = 'Exclusive',
+                                             @LockOwner = 'Session', @LockTimeout = %s;
+                SELECT @result;
+            """, (resource, int(timeout * 1000)))
+            result = cursor.fetchone()[0]
+            if result < 0:
+                raise TimeoutError(f"Could not acquire SQL Server lock '{resource}' (sp_getapplock {result})")
+            outer_lock_conn = getattr(self._tx, 'lock_conn', None)
+            self._tx.lock_conn = conn
+            try:
+                yield
+            finally:
+                self._tx.lock_conn = outer_lock_conn
+                cursor.execute("EXEC sp_releaseapplock @Resource = %s, @LockOwner = 'Session'", (resource,))
 
     def execute_query(self, query: str, params: tuple = None) -> List[Dict]:
         """Execute SELECT query and return results as list of dicts"""
-        with self.get_connection() as conn:
+        with self.get_connection(read_only=True) as conn:
             cursor = conn.cursor(as_dict=True)
             cursor.execute(query, params or ())
             return cursor.fetchall()
@@ -475,6 +1072,14 @@ class SQLServerManager:
             result = cursor.fetchone()
             return int(result[0]) if result and result[0] else None
 
+    def execute_insert_output(self, query: str, params: tuple = None) -> Optional[int]:
+        """Execute INSERT ... OUTPUT batch and return the first output column (one round trip)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params or ())
+            result = cursor.fetchone()
+            return int(result[0]) if result and result[0] else None
+
     def execute_update(self, query: str, params: tuple = None) -> int:
         """Execute UPDATE/DELETE query and return affected rows"""
         with self.get_connection() as conn:
@@ -485,7 +1090,7 @@ class SQLServerManager:
     def test_connection(self) -> Tuple[bool, str]:
         """Test database connection"""
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(read_only=True) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT @@VERSION as version")
                 result = cursor.fetchone()
@@ -537,42 +1142,50 @@ class SQLServerManager:
     # BackOffice Specific Queries
     # ========================================================================
 
-    def get_next_quotation_number(self, db_id: str = '1') -> str:
+    @staticmethod
+    def quotation_number_prefix(db_id: str = '1') -> str:
         """
-        Generate next quotation number using format: [Month][Day][Year][DB_ID][Counter]
-
-        Args:
-            db_id: Single character database identifier (e.g., '1', '6')
+        Today's quotation number prefix: [Month][Day][Year][DB_ID]
 
-        Returns:
-            Next quotation number as string
+        The counter completing the number is allocated by the header insert
+        batch (see _quotation_number_sql).
         """
-        from datetime import datetime
-
         today = datetime.now()
+        return f"{today.month}{today.day}{today.year}{db_id}"
 
-        # Build today's prefix: MDYYYY + db_id
-        date_prefix = f"{today.month}{today.day}{today.year}"
-        full_prefix = f"{date_prefix}{db_id}"
-
-        # Find max counter for today
-        prefix_len = len(full_prefix)
-        pattern = f"{full_prefix}%"
-
-        query_counter = """
-            SELECT ISNULL(
-                MAX(CAST(SUBSTRING(QuotationNumber, %s, LEN(QuotationNumber) - %s + 1) AS INT)),
-                0
-            ) + 1 as next_counter
-            FROM dbo.Quotations_tbl
-            WHERE QuotationNumber LIKE %s
-              AND ISNUMERIC(QuotationNumber) = 1
+    @staticmethod
+    def _quotation_number_sql() -> str:
+        """
+        Batch prefix that sets @qnum to the next quotation number for a prefix
+
+        Allocation is serialized per prefix with a transaction-owned
+        sp_getapplock, held until the inserting transaction ends, so a
+        concurrent allocation (from any thread or process) waits for it instead
+        of reading the same MAX. Quotations_tbl itself is only read, under
+        READ COMMITTED, so the ERP's own writers are never blocked by it.
+        TRY_CAST skips non-numeric suffixes.
+        """
+        return """
+            DECLARE @numlock INT;
+            EXEC @numlock = sp_getapplock @Resource = %s, @LockMode = 'Exclusive',
+                                          @LockOwner = 'Transaction', @LockTimeout = %s;
+            IF @numlock < 0
+                THROW 50000, 'Timed out waiting for the quotation number lock', 1;
+            DECLARE @qnum NVARCHAR(20) = %s + CAST((
+                SELECT ISNULL(MAX(TRY_CAST(
+                    SUBSTRING(QuotationNumber, %s, LEN(QuotationNumber) - %s + 1) AS INT
+                )), 0) + 1
+                FROM dbo.Quotations_tbl
+                WHERE QuotationNumber LIKE %s
+            ) AS NVARCHAR(10));
         """
 
-        result = self.execute_query(query_counter, (prefix_len + 1, prefix_len, pattern))
-        next_counter = result[0]['next_counter'] if result else 1
-
-        return f"{full_prefix}{next_counter}"
+    @staticmethod
+    def _quotation_number_params(number_prefix: str) -> tuple:
+        """Parameters for _quotation_number_sql"""
+        prefix_len = len(number_prefix)
+        return (f"quotation-number:{number_prefix}", int(APP_LOCK_TIMEOUT * 1000),
+                number_prefix, prefix_len + 1, prefix_len, f"{number_prefix}[0-9]%")
 
     def get_customer_by_id(self, customer_id: int) -> Optional[Dict]:
         """Get customer details by CustomerID"""
@@ -589,13 +1202,13 @@ class SQLServerManager:
 
     def get_customers_list(self, limit: int = 100) -> List[Dict]:
         """Get list of customers for dropdown"""
-        query = f"""
-            SELECT TOP {limit} CustomerID, BusinessName, AccountNo
+        query = """
+            SELECT TOP (%s) CustomerID, BusinessName, AccountNo
             FROM dbo.Customers_tbl
             WHERE Discontinued = 0 OR Discontinued IS NULL
             ORDER BY BusinessName
         """
-        return self.execute_query(query)
+        return self.execute_query(query, (int(limit),))
 
     def search_customers_by_account(self, query: str, limit: int = 10) -> List[Dict]:
         """
@@ -608,16 +1221,17 @@ class SQLServerManager:
         Returns:
             List of dicts with CustomerID, AccountNo, BusinessName
         """
-        # Search with case-insensitive matching
-        sql_query = f"""
-            SELECT TOP {limit} CustomerID, AccountNo, BusinessName, Discontinued
+        # BackOffice uses a case-insensitive collation, so LIKE already ignores
+        # case; wrapping AccountNo in UPPER() would rule out an index on it
+        sql_query = """
+            SELECT TOP (%s) CustomerID, AccountNo, BusinessName, Discontinued
             FROM dbo.Customers_tbl
-            WHERE UPPER(AccountNo) LIKE UPPER(%s)
+            WHERE AccountNo LIKE %s
                 AND (Discontinued = 0 OR Discontinued IS NULL)
             ORDER BY AccountNo
         """
         search_pattern = f"%{query}%"  # Search anywhere in AccountNo
-        results = self.execute_query(sql_query, (search_pattern,))
+        results = self.execute_query(sql_query, (int(limit), search_pattern))
         logger.info(f"Customer search '{query}' returned {len(results)} results")
         return results
 
@@ -633,6 +1247,23 @@ class SQLServerManager:
         results = self.execute_query(query, (upc,))
         return results[0] if results else None
 
+    def _lookup_upc_chunk(self, chunk: List[str]) -> Dict[str, Dict]:
+        """Items_tbl rows for at most UPC_LOOKUP_CHUNK_SIZE barcodes, by barcode"""
+        # Pad with a repeated barcode so the statement shape (and plan) is shared
+        size = _padded_size(len(chunk))
+        params = tuple(chunk) + (chunk[0],) * (size - len(chunk))
+        with self.get_connection(read_only=True) as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(_upc_lookup_sql(size), params)
+
+            # Build dict mapping barcode -> product
+            products = {}
+            for product in cursor.fetchall():
+                barcode = product.get('ProductUPC')
+                if barcode:
+                    products[barcode] = product
+            return products
+
     def get_products_by_upc_batch(self, upc_list: List[str]) -> Dict[str, Dict]:
         """
         Get multiple products by UPC/barcode in a single query
@@ -647,38 +1278,41 @@ class SQLServerManager:
             logger.warning(f"[{self.connection_type}] get_products_by_upc_batch called with empty list")
             return {}
 
-        # Log input barcodes for debugging
-        logger.info(f"[{self.connection_type}] Batch lookup for {len(upc_list)} barcodes: {upc_list[:5]}{'...' if len(upc_list) > 5 else ''}")
-
-        # Create placeholders for IN clause
-        placeholders = ','.join(['%s'] * len(upc_list))
-
-        query = f"""
-            SELECT ProductID, CateID, SubCateID, ProductSKU, ProductUPC,
-                   ProductDescription, UnitPrice, UnitCost, ItemSize, ItemWeight,
-                   UnitID, ItemTaxID
-            FROM dbo.Items_tbl
-            WHERE ProductUPC IN ({placeholders})
-        """
+        logger.debug("[%s] Batch lookup for %d barcodes: %s", self.connection_type,
+                     len(upc_list), upc_list[:5])
 
         try:
-            results = self.execute_query(query, tuple(upc_list))
-            logger.info(f"[{self.connection_type}] Query returned {len(results)} products")
+            # Chunk the IN list to stay well under SQL Server's 2100-parameter cap
+            chunks = [
+                upc_list[start:start + UPC_LOOKUP_CHUNK_SIZE]
+                for start in range(0, len(upc_list), UPC_LOOKUP_CHUNK_SIZE)
+            ]
+            # Chunks past the first run concurrently, unless a transaction on this
+            # thread must see its own uncommitted rows
+            pending = []
+            if len(chunks) > 1 and getattr(self._tx, 'conn', None) is None:
+                pending = [
+                    (chunk, sqlserver_lookups.submit(self._lookup_upc_chunk, chunk))
+                    for chunk in chunks[1:]
+                ]
+                chunks = chunks[:1]
 
-            # Build dict mapping barcode -> product
             products_dict = {}
-            for product in results:
-                barcode = product.get('ProductUPC')
-                if barcode:
-                    products_dict[barcode] = product
+            for chunk in chunks:
+                products_dict.update(self._lookup_upc_chunk(chunk))
+            for chunk, future in pending:
+                # This may itself run on a pool thread: chunks no worker has started
+                # yet are looked up here rather than waited for (no pool deadlock)
+                products_dict.update(self._lookup_upc_chunk(chunk) if future.cancel() else future.result())
+
+            logger.debug("[%s] Query returned %d products", self.connection_type, len(products_dict))
 
             # Log which barcodes were NOT found (critical for debugging)
-            found_barcodes = set(products_dict.keys())
-            missing = set(upc_list) - found_barcodes
+            missing = set(upc_list).difference(products_dict)
             if missing:
                 logger.warning(f"[{self.connection_type}] Barcodes NOT found in DB: {list(missing)}")
             else:
-                logger.info(f"[{self.connection_type}] All {len(upc_list)} barcodes found")
+                logger.debug("[%s] All %d barcodes found", self.connection_type, len(upc_list))
 
             return products_dict
 
@@ -686,6 +1320,50 @@ class SQLServerManager:
             logger.error(f"[{self.connection_type}] Batch query FAILED: {str(e)}")
             raise
 
+    def get_products_by_upc_batch_with(self, upc_list: List[str], other_database: str,
+                                       other_upc_list: List[str]) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        """
+        Look up barcodes in this database and in another database on the same server
+        in one round trip (UNION ALL, rows tagged by source)
+
+        The login must be able to read other_database; callers fall back to two
+        get_products_by_upc_batch calls when it cannot.
+
+        Returns:
+            (barcode -> product here, barcode -> product in other_database)
+        """
+        other_table = f"[{other_database.replace(']', ']]')}].dbo.Items_tbl"
+        select = """
+            SELECT {source} AS LookupSource, ProductID, CateID, SubCateID, ProductSKU, ProductUPC,
+                   ProductDescription, UnitPrice, UnitCost, ItemSize, ItemWeight,
+                   UnitID, ItemTaxID
+            FROM {table}
+            WHERE ProductUPC IN ({placeholders})
+        """
+        found = ({}, {})
+        with self.get_connection(read_only=True) as conn:
+            cursor = conn.cursor(as_dict=True)
+            for start in range(0, max(len(upc_list), len(other_upc_list)), UPC_LOOKUP_CHUNK_SIZE):
+                parts, params = [], []
+                for source, table, upcs in ((0, 'dbo.Items_tbl', upc_list),
+                                            (1, other_table, other_upc_list)):
+                    chunk = upcs[start:start + UPC_LOOKUP_CHUNK_SIZE]
+                    if chunk:
+                        parts.append(select.format(source=source, table=table,
+                                                   placeholders=','.join(['%s'] * len(chunk))))
+                        params.extend(chunk)
+                cursor.execute(' UNION ALL '.join(parts), tuple(params))
+
+                for product in cursor.fetchall():
+                    source = product.pop('LookupSource')
+                    barcode = product.get('ProductUPC')
+                    if barcode:
+                        found[source][barcode] = product
+
+        logger.debug("[%s] Cross-database lookup returned %d + %d products", self.connection_type,
+                     len(found[0]), len(found[1]))
+        return found
+
     def copy_product_from_inventory(self, inventory_product: Dict) -> Dict:
         """
         Copy product from Inventory database to BackOffice Items_tbl
@@ -696,35 +1374,69 @@ class SQLServerManager:
         Returns:
             Full product dict with new ProductID
         """
-        query = """
-            INSERT INTO dbo.Items_tbl (
-                CateID, SubCateID, ProductSKU, ProductUPC, ProductDescription,
-                UnitPrice, UnitCost, ItemSize, ItemWeight, UnitID, ItemTaxID,
-                SPPromoted
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            )
+        placeholders = ', '.join(['%s'] * len(ITEM_COPY_COLUMNS))
+        query = f"""
+            INSERT INTO dbo.Items_tbl ({', '.join(ITEM_COPY_COLUMN_NAMES)})
+            VALUES ({placeholders})
         """
-        product_id = self.execute_insert(query, (
-            inventory_product.get('CateID'),
-            inventory_product.get('SubCateID'),
-            inventory_product.get('ProductSKU'),
-            inventory_product.get('ProductUPC'),
-            inventory_product.get('ProductDescription'),
-            inventory_product.get('UnitPrice'),
-            inventory_product.get('UnitCost'),
-            inventory_product.get('ItemSize'),
-            inventory_product.get('ItemWeight'),
-            inventory_product.get('UnitID'),
-            inventory_product.get('ItemTaxID'),
-            inventory_product.get('SPPromoted', 0)  # Default to 0 if not in Inventory
-        ))
+        product_id = self.execute_insert(query, self._item_copy_params(inventory_product))
 
         # Return full product dict with new ProductID
         copied_product = dict(inventory_product)
         copied_product['ProductID'] = product_id
         return copied_product
 
+    def copy_products_from_inventory_bulk(self, inventory_products: List[Dict]) -> Dict[str, Dict]:
+        """
+        Copy several Inventory products to BackOffice Items_tbl
+
+        Rows go in as multi-row INSERTs (chunked under the parameter limit) on one
+        connection, so either every product is copied or none is. New ProductIDs
+        come back through OUTPUT INTO a table variable, keyed by ProductUPC.
+
+        Args:
+            inventory_products: Product dicts from Inventory database (unique UPCs)
+
+        Returns:
+            Dict mapping ProductUPC -> full product dict with new ProductID
+        """
+        if not inventory_products:
+            return {}
+
+        by_upc = {p['ProductUPC']: p for p in inventory_products}
+        columns = ', '.join(ITEM_COPY_COLUMN_NAMES)
+        row_placeholders = '(' + ', '.join(['%s'] * len(ITEM_COPY_COLUMNS)) + ')'
+        chunk_size = SQLSERVER_MAX_PARAMS // len(ITEM_COPY_COLUMNS)
+        products = list(by_upc.values())
+
+        copied = {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(products), chunk_size):
+                chunk = products[start:start + chunk_size]
+                query = f"""
+                    SET NOCOUNT ON;
+                    DECLARE @copied TABLE (ProductID INT, ProductUPC NVARCHAR(255));
+                    INSERT INTO dbo.Items_tbl ({columns})
+                    OUTPUT INSERTED.ProductID, INSERTED.ProductUPC INTO @copied
+                    VALUES {', '.join([row_placeholders] * len(chunk))};
+                    SELECT ProductID, ProductUPC FROM @copied;
+                """
+                params = tuple(v for p in chunk for v in self._item_copy_params(p))
+                cursor.execute(query, params)
+                for product_id, upc in cursor.fetchall():
+                    copied_product = dict(by_upc[upc])
+                    copied_product['ProductID'] = int(product_id)
+                    copied[upc] = copied_product
+
+        return copied
+
+    @staticmethod
+    def _item_copy_params(inventory_product: Dict) -> tuple:
+        """Items_tbl insert values for an Inventory product, in ITEM_COPY_COLUMNS order"""
+        get = inventory_product.get
+        return tuple(get(col, default) for col, default in ITEM_COPY_COLUMNS)
+
     def get_unit_description(self, unit_id: int) -> Optional[str]:
         """Get unit description from Units_tbl"""
         if not unit_id:
@@ -733,103 +1445,293 @@ class SQLServerManager:
         results = self.execute_query(query, (unit_id,))
         return results[0]['UnitDesc'] if results else None
 
-    def create_quotation_header(self, quotation_data: Dict) -> int:
-        """Create quotation header and return QuotationID"""
-        query = """
-            INSERT INTO dbo.Quotations_tbl (
-                QuotationNumber, QuotationDate, QuotationTitle, PoNumber, AutoOrderNo,
-                ExpirationDate, CustomerID, BusinessName, AccountNo,
-                Shipto, ShipAddress1, ShipAddress2, ShipContact,
-                ShipCity, ShipState, ShipZipCode, ShipPhoneNo,
-                Status, ShipperID, SalesRepID, TermID, TotalTaxes, QuotationTotal,
-                Header, Footer, Notes, Memo, flaged
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            )
+    def get_unit_descriptions_bulk(self, unit_ids) -> Dict[int, str]:
         """
-        return self.execute_insert(query, (
-            quotation_data['QuotationNumber'],
-            quotation_data['QuotationDate'],
-            quotation_data['QuotationTitle'],
-            quotation_data.get('PoNumber'),
-            quotation_data.get('AutoOrderNo'),
-            quotation_data['ExpirationDate'],
-            quotation_data['CustomerID'],
-            quotation_data['BusinessName'],
-            quotation_data.get('AccountNo'),
-            quotation_data.get('Shipto'),
-            quotation_data.get('ShipAddress1'),
-            quotation_data.get('ShipAddress2', ''),
-            quotation_data.get('ShipContact'),
-            quotation_data.get('ShipCity'),
-            quotation_data.get('ShipState'),
-            quotation_data.get('ShipZipCode'),
-            quotation_data.get('ShipPhoneNo', ''),
-            quotation_data.get('Status'),
-            quotation_data.get('ShipperID'),
-            quotation_data.get('SalesRepID'),
-            quotation_data.get('TermID'),
-            quotation_data.get('TotalTaxes', 0),
-            quotation_data.get('QuotationTotal', 0),
-            quotation_data.get('Header', ''),
-            quotation_data.get('Footer', ''),
-            quotation_data.get('Notes', ''),
-            quotation_data.get('Memo', ''),
-            quotation_data.get('flaged', 0)
-        ))
+        Get unit descriptions for several UnitIDs in a single query
+
+        Args:
+            unit_ids: Iterable of UnitID values (falsy values are skipped)
+
+        Returns:
+            Dict mapping UnitID -> UnitDesc
+        """
+        unit_ids = [unit_id for unit_id in set(unit_ids) if unit_id]
+        if not unit_ids:
+            return {}
+
+        placeholders = ','.join(['%s'] * len(unit_ids))
+        query = f"SELECT UnitID, UnitDesc FROM dbo.Units_tbl WHERE UnitID IN ({placeholders})"
+        results = self.execute_query(query, tuple(unit_ids))
+        return {row['UnitID']: row['UnitDesc'] for row in results}
+
+    def create_quotation_header(self, quotation_data: Dict,
+                                number_prefix: str) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Create quotation header, allocating its QuotationNumber in the same batch
+
+        The new ID comes back through OUTPUT in the same batch as the INSERT
+        (no separate SCOPE_IDENTITY() round trip). OUTPUT goes INTO a table
+        variable so the statement stays valid if Quotations_tbl has triggers.
+
+        Args:
+            quotation_data: Header values in QUOTATION_HEADER_COLUMNS
+            number_prefix: Quotation number prefix (see quotation_number_prefix)
+
+        Returns:
+            (QuotationID, QuotationNumber)
+        """
+        query = f"""
+            SET NOCOUNT ON;
+            {self._quotation_number_sql()}
+            DECLARE @inserted TABLE (QuotationID INT);
+            {self._quotation_header_insert_sql()}
+            SELECT QuotationID, @qnum FROM @inserted;
+        """
+        params = self._quotation_number_params(number_prefix) + self._quotation_header_params(quotation_data)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            result = cursor.fetchone()
+
+        if not result or not result[0]:
+            return None, None
+        return int(result[0]), result[1]
+
+    def create_quotation_with_lines(self, quotation_data: Dict, number_prefix: str,
+                                    rows: Iterable[tuple]) -> Tuple[Optional[int], Optional[str], int]:
+        """
+        Create the quotation header and its lines in as few round trips as possible
+
+        The header and the first chunk of lines go in one batch, with the lines
+        taking the new QuotationID from a variable. Lines beyond what fits under
+        the parameter limit follow through create_quotation_lines_bulk. If a
+        line is rejected (see _is_bad_line) the batch is rolled back to a
+        savepoint and redone as header + create_quotation_lines_bulk, which
+        isolates bad lines.
+
+        Args:
+            quotation_data: Header values (see create_quotation_header)
+            number_prefix: Quotation number prefix (see quotation_number_prefix)
+            rows: Line value tuples in QUOTATION_LINE_COLUMNS order (list or generator)
+
+        Returns:
+            (QuotationID, QuotationNumber, number of lines inserted)
+        """
+        header_params = (self._quotation_number_params(number_prefix)
+                         + self._quotation_header_params(quotation_data))
+        first_chunk_size = (SQLSERVER_MAX_PARAMS - len(header_params)) // len(QUOTATION_LINE_COLUMNS)
+
+        rows = iter(rows)
+        first_chunk = list(islice(rows, first_chunk_size))
+        if not first_chunk:
+            return self.create_quotation_header(quotation_data, number_prefix) + (0,)
+
+        columns = ', '.join(QUOTATION_LINE_COLUMN_NAMES)
+        row_placeholder = '(@qid, ' + ', '.join(['%s'] * len(QUOTATION_LINE_COLUMNS)) + ')'
+        query = f"""
+            SET NOCOUNT ON;
+            SAVE TRANSACTION quotation_batch;
+            {self._quotation_number_sql()}
+            DECLARE @inserted TABLE (QuotationID INT);
+            {self._quotation_header_insert_sql()}
+            DECLARE @qid INT = (SELECT QuotationID FROM @inserted);
+            INSERT INTO dbo.QuotationsDetails_tbl (QuotationID, {columns})
+            VALUES {', '.join([row_placeholder] * len(first_chunk))};
+            DECLARE @lines INT = @@ROWCOUNT;
+            SELECT @qid, @qnum, @lines;
+        """
+        params = header_params + tuple(value for row in first_chunk for value in row)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                quotation_id, quotation_number, inserted = cursor.fetchone()
+            except pymssql.DatabaseError as e:
+                if not _is_bad_line(e):
+                    raise
+                cursor.execute("ROLLBACK TRANSACTION quotation_batch")
+                logger.warning("[%s] Quotation batch rejected, inserting header and lines separately: %s",
+                               self.connection_type, e)
+                quotation_id, quotation_number = self.create_quotation_header(quotation_data, number_prefix)
+                if not quotation_id:
+                    return None, None, 0
+                return quotation_id, quotation_number, self.create_quotation_lines_bulk(
+                    quotation_id, chain(first_chunk, rows)
+                )
+
+            quotation_id = int(quotation_id) if quotation_id else None
+            if quotation_id:
+                inserted += self.create_quotation_lines_bulk(quotation_id, rows)
+            return quotation_id, quotation_number, inserted
+
+    @staticmethod
+    def _quotation_header_insert_sql() -> str:
+        """INSERT for Quotations_tbl (number from @qnum) that OUTPUTs the new QuotationID INTO @inserted"""
+        placeholders = ', '.join(['%s'] * len(QUOTATION_HEADER_COLUMNS))
+        return f"""
+            INSERT INTO dbo.Quotations_tbl
+                (QuotationNumber, {', '.join(col for col, _ in QUOTATION_HEADER_COLUMNS)})
+            OUTPUT INSERTED.QuotationID INTO @inserted
+            VALUES (@qnum, {placeholders});
+        """
+
+    @staticmethod
+    def _quotation_header_params(quotation_data: Dict) -> tuple:
+        """Order header dict values to match QUOTATION_HEADER_COLUMNS"""
+        return tuple(
+            quotation_data[col] if default is REQUIRED else quotation_data.get(col, default)
+            for col, default in QUOTATION_HEADER_COLUMNS
+        )
 
     def create_quotation_line(self, quotation_id: int, line_data: Dict) -> int:
         """Create quotation detail line"""
+        columns = ', '.join(QUOTATION_LINE_COLUMN_NAMES)
+        placeholders = ', '.join(['%s'] * (len(QUOTATION_LINE_COLUMNS) + 1))
+        query = f"""
+            INSERT INTO dbo.QuotationsDetails_tbl (QuotationID, {columns})
+            VALUES ({placeholders})
+        """
+        return self.execute_insert(query, self._quotation_line_params(quotation_id, line_data))
+
+    def create_quotation_lines_bulk(self, quotation_id: int, rows: Iterable[tuple]) -> int:
+        """
+        Create all quotation detail lines with multi-row INSERT statements
+
+        pymssql has no fast_executemany, so rows are packed into
+        INSERT ... VALUES (...),(...) statements sized under the
+        2100-parameter limit - one round trip per chunk instead of per line.
+        Rows are consumed chunk by chunk, so a generator keeps only one
+        chunk in memory at a time.
+
+        A chunk rejected for its values (constraint violation, or a value that
+        doesn't fit its column; see _is_bad_line) is rolled back to a savepoint
+        and bisected, so only the offending lines are skipped. Other errors,
+        such as a dropped connection, fail the whole quotation: its transaction
+        is gone.
+
+        Args:
+            quotation_id: Parent QuotationID
+            rows: Line value tuples in QUOTATION_LINE_COLUMNS order (list or generator)
+
+        Returns:
+            Number of lines inserted
+        """
+        chunk_size = SQLSERVER_MAX_PARAMS // (len(QUOTATION_LINE_COLUMNS) + 1)
+
+        rows = iter(rows)
+        inserted = 0
+        total = 0
+        rejected: List[Tuple[Any, str]] = []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                total += len(chunk)
+                inserted += self._insert_quotation_line_chunk(cursor, quotation_id, chunk, rejected)
+
+        # One summary line instead of a log call per rejected row
+        if rejected:
+            logger.warning("[%s] Failed %d of %d quotation lines for quotation %s: %s",
+                           self.connection_type, len(rejected), total, quotation_id, rejected)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[%s] Inserted %d quotation lines for quotation %s",
+                         self.connection_type, inserted, quotation_id)
+
+        return inserted
+
+    def _insert_quotation_line_chunk(self, cursor, quotation_id: int, chunk: List[tuple],
+                                     rejected: List[Tuple[Any, str]]) -> int:
+        """Insert one chunk of lines, bisecting on bad-line errors to isolate bad rows"""
+        columns = ', '.join(QUOTATION_LINE_COLUMN_NAMES)
+        row_placeholder = '(' + ', '.join(['%s'] * (len(QUOTATION_LINE_COLUMNS) + 1)) + ')'
+        query = f"""
+            SAVE TRANSACTION quotation_lines;
+            INSERT INTO dbo.QuotationsDetails_tbl (QuotationID, {columns})
+            VALUES {', '.join([row_placeholder] * len(chunk))}
+        """
+        params = []
+        for row in chunk:
+            params.append(quotation_id)
+            params.extend(row)
+
+        try:
+            cursor.execute(query, tuple(params))
+            return cursor.rowcount
+        except pymssql.DatabaseError as e:
+            if not _is_bad_line(e):
+                raise
+            cursor.execute("ROLLBACK TRANSACTION quotation_lines")
+            if len(chunk) == 1:
+                rejected.append((chunk[0][QUOTATION_LINE_COLUMN_NAMES.index('ProductUPC')], str(e)))
+                return 0
+            mid = len(chunk) // 2
+            return (self._insert_quotation_line_chunk(cursor, quotation_id, chunk[:mid], rejected) +
+                    self._insert_quotation_line_chunk(cursor, quotation_id, chunk[mid:], rejected))
+
+    def update_quotation_total(self, quotation_id: int) -> float:
+        """
+        Set QuotationTotal to the sum of the quotation's inserted lines
+
+        Used after rejected lines were skipped, so the header total matches its lines.
+
+        Returns:
+            The new QuotationTotal
+        """
         query = """
-            INSERT INTO dbo.QuotationsDetails_tbl (
-                QuotationID, CateID, SubCateID, UnitDesc, UnitQty,
-                ProductID, ProductSKU, ProductUPC, ProductDescription, ItemSize,
-                ExpDate, ReasonID, LineMessage,
-                UnitPrice, OriginalPrice, RememberPrice, UnitCost,
-                Discount, ds_Percent, Qty, ItemWeight,
-                ExtendedPrice, ExtendedDisc, ExtendedCost,
-                PromotionID, PromotionLine, PromotionDescription, PromotionAmount,
-                ActExtendedPrice, SPPromoted, SPPromotionDescription,
-                Taxable, ItemTaxID, Catch, Comments, Flag
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+            SET NOCOUNT ON;
+            UPDATE dbo.Quotations_tbl
+            SET QuotationTotal = (
+                SELECT ISNULL(SUM(ExtendedPrice), 0) FROM dbo.QuotationsDetails_tbl
+                WHERE QuotationID = %s
             )
+            WHERE QuotationID = %s;
+            SELECT QuotationTotal FROM dbo.Quotations_tbl WHERE QuotationID = %s;
         """
-        return self.execute_insert(query, (
-            quotation_id,
-            line_data.get('CateID'),
-            line_data.get('SubCateID'),
-            line_data.get('UnitDesc'),
-            line_data.get('UnitQty', 1),
-            line_data.get('ProductID'),
-            line_data.get('ProductSKU'),
-            line_data.get('ProductUPC'),
-            line_data.get('ProductDescription'),
-            line_data.get('ItemSize', ''),
-            line_data.get('ExpDate'),
-            line_data.get('ReasonID'),
-            line_data.get('LineMessage', ''),
-            line_data.get('UnitPrice'),
-            line_data.get('OriginalPrice'),
-            line_data.get('RememberPrice', 0),
-            line_data.get('UnitCost'),
-            line_data.get('Discount', 0),
-            line_data.get('ds_Percent', 0),
-            line_data.get('Qty'),
-            line_data.get('ItemWeight'),
-            line_data.get('ExtendedPrice'),
-            line_data.get('ExtendedDisc', 0),
-            line_data.get('ExtendedCost'),
-            line_data.get('PromotionID'),
-            line_data.get('PromotionLine', 0),
-            line_data.get('PromotionDescription', ''),
-            line_data.get('PromotionAmount', 0),
-            line_data.get('ActExtendedPrice', 0),
-            line_data.get('SPPromoted', 0),
-            line_data.get('SPPromotionDescription', ''),
-            line_data.get('Taxable', 0),
-            line_data.get('ItemTaxID'),
-            line_data.get('Catch'),
-            line_data.get('Comments', ''),
-            line_data.get('Flag', 0)
-        ))
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (quotation_id,) * 3)
+            result = cursor.fetchone()
+        return float(result[0]) if result and result[0] is not None else 0.0
+
+    @staticmethod
+    def _quotation_line_params(quotation_id: int, line_data: Dict) -> tuple:
+        """Order line dict values to match QUOTATION_LINE_COLUMNS"""
+        return (quotation_id,) + tuple(
+            line_data.get(col, default) for col, default in QUOTATION_LINE_COLUMNS
+        )
+
+
+def get_sqlserver_manager(connection_config: Dict) -> SQLServerManager:
+    """Get the shared SQLServerManager for a saved connection config"""
+    manager = SQLServerManager(connection_config)
+    with _sqlserver_managers_lock:
+        cached = _sqlserver_managers.get(manager.connection_type)
+        if cached is None or cached.settings != manager.settings:
+            cached = _sqlserver_managers[manager.connection_type] = manager
+        return cached
+
+
+def close_sqlserver_connections(idle_for: float = 0) -> int:
+    """
+    Close idle SQL Server connections unused for at least idle_for seconds
+
+    With the default every idle connection is closed (Gunicorn worker_exit).
+
+    Returns:
+        Number of connections closed
+    """
+    cutoff = time.monotonic() - idle_for
+    with _idle_sqlserver_connections_lock:
+        stale = [slot for slot, (_, last_used) in _idle_sqlserver_connections.items()
+                 if last_used <= cutoff]
+        conns = [_idle_sqlserver_connections.pop(slot)[0] for slot in stale]
+
+    for conn in conns:
+        SQLServerManager._close_quietly(conn)
+    if conns:
+        logger.info(f"Closed {len(conns)} idle SQL Server connection(s)")
+    return len(conns)
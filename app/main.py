@@ -5,12 +5,20 @@ Handles API endpoints for orders, settings, and history management
 
 import os
 import logging
-from flask import Flask, render_template, jsonify, request
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import orjson
+from flask import Flask, Response, render_template, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from datetime import datetime
+from werkzeug.http import http_date
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import date, datetime
+from decimal import Decimal
 from zoneinfo import ZoneInfo
 
-from app.database import PostgreSQLManager, SQLServerManager
+from app.database import PostgreSQLManager, SQLServerManager, get_sqlserver_manager
 from app.shopify_client import ShopifyClient
 from app.validator import ProductValidator
 from app.converter import QuotationConverter
@@ -22,8 +30,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def _orjson_default(obj):
+    """
+    Types orjson doesn't serialize natively, plus the dates it is told to pass
+    through, encoded as Flask's default provider does (dates as RFC 822 HTTP dates)
+    """
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify() through orjson: faster encoding, same output as Flask's default provider"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(
+            obj, default=_orjson_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Initialize Flask app
 app = Flask(__name__)
+# Trust one proxy hop (nginx, see PRODUCTION.md) for client IP and scheme
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+app.json = OrjsonProvider(app)
 app.config['JSON_SORT_KEYS'] = False
 CORS(app)
 
@@ -44,12 +81,47 @@ def get_sqlserver_managers():
     if not inventory_config:
         raise Exception("Inventory database not configured")
 
-    backoffice = SQLServerManager(backoffice_config)
-    inventory = SQLServerManager(inventory_config)
+    backoffice = get_sqlserver_manager(backoffice_config)
+    inventory = get_sqlserver_manager(inventory_config)
 
     return backoffice, inventory
 
 
+# Orders of transfer requests are processed concurrently on this long-lived pool,
+# shared by every request of the worker: its threads (and their cached SQL Server
+# connections) survive between requests instead of logging in again each time
+TRANSFER_WORKERS = 8
+_transfer_workers = ThreadPoolExecutor(max_workers=TRANSFER_WORKERS, thread_name_prefix='transfer')
+
+# BackOffice customer dropdown, cached briefly: (backoffice key, loaded_at, customers)
+CUSTOMERS_CACHE_TTL = 60
+_customers_cache = None
+
+# Shopify clients kept per store so their HTTP sessions (keep-alive) are reused:
+# {store_id: ((shop_url, api_token), ShopifyClient)}
+_shopify_clients = {}
+_shopify_clients_lock = threading.Lock()
+
+
+def get_shopify_client(store: dict) -> ShopifyClient:
+    """Get the cached ShopifyClient for a store, rebuilding it if credentials changed"""
+    credentials = (store['shop_url'], store['admin_api_token'])
+    with _shopify_clients_lock:
+        cached = _shopify_clients.get(store['id'])
+        if cached is None or cached[0] != credentials:
+            cached = (credentials, ShopifyClient(*credentials))
+            _shopify_clients[store['id']] = cached
+        return cached[1]
+
+
+def forget_shopify_client(store_id: int):
+    """Drop a store's cached ShopifyClient (after update/delete)"""
+    with _shopify_clients_lock:
+        cached = _shopify_clients.pop(store_id, None)
+    if cached is not None:
+        cached[1].close()
+
+
 # ============================================================================
 # PAGE ROUTES
 # ============================================================================
@@ -116,6 +188,7 @@ def update_store(store_id):
         api_token = data.get('api_token')
 
         affected = postgres.update_shopify_store(store_id, name, shop_url, api_token)
+        forget_shopify_client(store_id)
         return jsonify({'success': True, 'affected_rows': affected})
     except Exception as e:
         logger.error(f"Failed to update store: {str(e)}")
@@ -127,6 +200,7 @@ def delete_store(store_id):
     """Delete Shopify store"""
     try:
         affected = postgres.delete_shopify_store(store_id)
+        forget_shopify_client(store_id)
         return jsonify({'success': True, 'affected_rows': affected})
     except Exception as e:
         logger.error(f"Failed to delete store: {str(e)}")
@@ -141,7 +215,7 @@ def test_store_connection(store_id):
         if not store:
             return jsonify({'success': False, 'error': 'Store not found'}), 404
 
-        client = ShopifyClient(store['shop_url'], store['admin_api_token'])
+        client = get_shopify_client(store)
         success, message = client.test_connection()
 
         return jsonify({'success': success, 'message': message})
@@ -158,13 +232,7 @@ def test_store_connection(store_id):
 def get_sql_connections():
     """Get SQL Server connection configs (passwords excluded from response)"""
     try:
-        connections = postgres.get_sql_connections()
-
-        # Remove passwords from response
-        for conn in connections:
-            if 'password' in conn:
-                del conn['password']
-
+        connections = postgres.get_sql_connections_public()
         return jsonify({'success': True, 'connections': connections})
     except Exception as e:
         logger.error(f"Failed to get SQL connections: {str(e)}")
@@ -254,8 +322,17 @@ def save_customer_mapping():
 def get_customers_list():
     """Get list of customers from BackOffice for dropdown"""
     try:
+        global _customers_cache
         backoffice, _ = get_sqlserver_managers()
-        customers = backoffice.get_customers_list(limit=500)
+        key = (backoffice.host, backoffice.port, backoffice.database)
+
+        cached = _customers_cache
+        if cached and cached[0] == key and time.monotonic() - cached[1] < CUSTOMERS_CACHE_TTL:
+            customers = cached[2]
+        else:
+            customers = backoffice.get_customers_list(limit=500)
+            _customers_cache = (key, time.monotonic(), customers)
+
         return jsonify({'success': True, 'customers': customers})
     except Exception as e:
         logger.error(f"Failed to get customers list: {str(e)}")
@@ -345,16 +422,15 @@ def get_orders():
             return jsonify({'success': False, 'error': 'Store not found'}), 404
 
         # Check if already transferred
-        client = ShopifyClient(store['shop_url'], store['admin_api_token'])
+        client = get_shopify_client(store)
         result = client.get_unfulfilled_orders(days_back=days_back)
 
         orders = result['orders']
 
-        # Mark orders that have been transferred
+        # Mark orders that have been transferred (one query for the whole page)
+        transferred = postgres.check_orders_transferred(store_id, (order['id'] for order in orders))
         for order in orders:
-            order['transferred'] = postgres.check_order_transferred(
-                store_id, order['id']
-            )
+            order['transferred'] = str(order['id']) in transferred
 
         return jsonify({
             'success': True,
@@ -383,7 +459,7 @@ def validate_order_products():
         if not store:
             return jsonify({'success': False, 'error': 'Store not found'}), 404
 
-        client = ShopifyClient(store['shop_url'], store['admin_api_token'])
+        client = get_shopify_client(store)
         order = client.get_order_by_id(order_id)
 
         if not order:
@@ -408,6 +484,118 @@ def validate_order_products():
         return jsonify({'success': False, 'error': error_msg}), 500
 
 
+def save_transfer_records(records):
+    """Write transfer history rows in one INSERT, falling back to one row at a time"""
+    if not records:
+        return
+    try:
+        postgres.create_transfer_records_bulk(records)
+    except Exception as e:
+        if len(records) == 1:
+            logger.error(f"Failed to record transfer of order {records[0]['order_id']}: {str(e)}")
+            return
+        # e.g. a concurrent transfer of the same order hit the unique success index;
+        # keep every other record
+        logger.warning(f"Bulk transfer record insert failed, retrying per record: {str(e)}")
+        for record in records:
+            try:
+                postgres.create_transfer_records_bulk([record])
+            except Exception as record_error:
+                logger.error(f"Failed to record transfer of order {record['order_id']}: {str(record_error)}")
+
+
+def _process_single_order(order_id, store_id, client, validator, converter, custom_customer_id=None):
+    """
+    Fetch, validate and convert one Shopify order
+
+    A successful transfer is written to transfer_history as soon as its quotation
+    commits, so a crash or timeout later in the batch cannot let a retry pass
+    check_orders_transferred and create the quotation twice.
+
+    Returns:
+        (result dict for the response, failed-attempt transfer_history record or None)
+    """
+    try:
+        # Fetch order
+        order = client.get_order_by_id(order_id)
+        if not order:
+            return {
+                'order_id': order_id,
+                'success': False,
+                'error': 'Order not found',
+                'quotation_number': None
+            }, None
+
+        # Validate products
+        validation = validator.validate_order_products(order['line_items'])
+
+        if not validation['valid']:
+            error_msg = f"Missing products: {', '.join([m['barcode'] for m in validation['missing']])}"
+            # Record failed attempt
+            record = {
+                'store_id': store_id, 'order_id': order['id'], 'order_name': order['name'],
+                'status': 'failed', 'error_message': error_msg,
+                'line_items_count': len(order['line_items']),
+                'total_amount': order['total_amount']
+            }
+            return {
+                'order_id': order_id,
+                'order_name': order['name'],
+                'success': False,
+                'error': error_msg,
+                'quotation_number': None,
+                'validation': validation
+            }, record
+
+        # Create quotation (the number is allocated atomically by its insert)
+        conv_result = converter.create_quotation_with_transaction(
+            order, store_id, validation['products'], customer_id_override=custom_customer_id
+        )
+
+        if conv_result['success']:
+            # Record successful transfer right away
+            save_transfer_records([{
+                'store_id': store_id, 'order_id': order['id'], 'order_name': order['name'],
+                'quotation_number': conv_result['quotation_number'], 'status': 'success',
+                'line_items_count': conv_result['line_items'],
+                'total_amount': conv_result['total_amount']
+            }])
+            # Transferred orders are not fetched for another transfer; free the cache slot
+            client.invalidate_order(order_id)
+            return {
+                'order_id': order_id,
+                'order_name': order['name'],
+                'success': True,
+                'quotation_number': conv_result['quotation_number'],
+                'line_items': conv_result['line_items'],
+                'total_amount': conv_result['total_amount']
+            }, None
+
+        # Record failed attempt
+        record = {
+            'store_id': store_id, 'order_id': order['id'], 'order_name': order['name'],
+            'status': 'failed', 'error_message': conv_result['error'],
+            'line_items_count': len(order['line_items']),
+            'total_amount': order['total_amount']
+        }
+        return {
+            'order_id': order_id,
+            'order_name': order['name'],
+            'success': False,
+            'error': conv_result['error'],
+            'quotation_number': None
+        }, record
+
+    except Exception as order_error:
+        logger.error(f"Failed to transfer order {order_id}: {str(order_error)}")
+        return {
+            'order_id': order_id,
+            'success': False,
+            'error': str(order_error),
+            'quotation_number': None
+        }, None
+
+
 @app.route('/api/orders/transfer', methods=['POST'])
 def transfer_orders():
     """Transfer selected orders to quotations"""
@@ -425,104 +613,44 @@ def transfer_orders():
             return jsonify({'success': False, 'error': 'Store not found'}), 404
 
         # Initialize managers
-        client = ShopifyClient(store['shop_url'], store['admin_api_token'])
+        client = get_shopify_client(store)
         backoffice, inventory = get_sqlserver_managers()
         validator = ProductValidator(backoffice, inventory)
         converter = QuotationConverter(backoffice, postgres)
 
-        results = []
+        # Check which orders were already transferred (one query for the batch)
+        transferred = postgres.check_orders_transferred(store_id, order_ids)
 
-        for order_id in order_ids:
-            try:
-                # Check if already transferred
-                if postgres.check_order_transferred(store_id, order_id):
-                    results.append({
-                        'order_id': order_id,
-                        'success': False,
-                        'error': 'Order already transferred',
-                        'quotation_number': None
-                    })
-                    continue
-
-                # Fetch order
-                order = client.get_order_by_id(order_id)
-                if not order:
-                    results.append({
-                        'order_id': order_id,
-                        'success': False,
-                        'error': 'Order not found',
-                        'quotation_number': None
-                    })
-                    continue
-
-                # Validate products
-                validation = validator.validate_order_products(order['line_items'])
-
-                if not validation['valid']:
-                    error_msg = f"Missing products: {', '.join([m['barcode'] for m in validation['missing']])}"
-                    results.append({
-                        'order_id': order_id,
-                        'order_name': order['name'],
-                        'success': False,
-                        'error': error_msg,
-                        'quotation_number': None,
-                        'validation': validation
-                    })
-
-                    # Record failed attempt
-                    postgres.create_transfer_record(
-                        store_id, order['id'], order['name'], None, 'failed',
-                        error_msg, len(order['line_items']), order['total_amount']
-                    )
-                    continue
-
-                # Get custom customer_id if provided
-                custom_customer_id = custom_customers.get(order_id)
-
-                # Create quotation
-                conv_result = converter.create_quotation_with_transaction(
-                    order, store_id, validation['products'], customer_id_override=custom_customer_id
-                )
-
-                if conv_result['success']:
-                    # Record successful transfer
-                    postgres.create_transfer_record(
-                        store_id, order['id'], order['name'],
-                        conv_result['quotation_number'], 'success',
-                        None, conv_result['line_items'], conv_result['total_amount']
-                    )
-
-                    results.append({
-                        'order_id': order_id,
-                        'order_name': order['name'],
-                        'success': True,
-                        'quotation_number': conv_result['quotation_number'],
-                        'line_items': conv_result['line_items'],
-                        'total_amount': conv_result['total_amount']
-                    })
-                else:
-                    # Record failed attempt
-                    postgres.create_transfer_record(
-                        store_id, order['id'], order['name'], None, 'failed',
-                        conv_result['error'], len(order['line_items']), order['total_amount']
-                    )
-
-                    results.append({
-                        'order_id': order_id,
-                        'order_name': order['name'],
-                        'success': False,
-                        'error': conv_result['error'],
-                        'quotation_number': None
-                    })
-
-            except Exception as order_error:
-                logger.error(f"Failed to transfer order {order_id}: {str(order_error)}")
-                results.append({
+        # Results keep request order; orders to process run concurrently below
+        results = [None] * len(order_ids)
+        pending = {}
+        for index, order_id in enumerate(order_ids):
+            if str(order_id) in transferred or str(order_id) in pending:
+                results[index] = {
                     'order_id': order_id,
                     'success': False,
-                    'error': str(order_error),
+                    'error': 'Order already transferred',
                     'quotation_number': None
-                })
+                }
+            else:
+                pending[str(order_id)] = index
+
+        failed_records = []  # Written to transfer_history in one INSERT after the loop
+        if pending:
+            futures = {
+                _transfer_workers.submit(
+                    _process_single_order, order_ids[index], store_id, client,
+                    validator, converter, custom_customers.get(order_ids[index])
+                ): index
+                for index in pending.values()
+            }
+            for future in as_completed(futures):
+                result, record = future.result()
+                results[futures[future]] = result
+                if record:
+                    failed_records.append(record)
+
+        save_transfer_records(failed_records)
 
         success_count = sum(1 for r in results if r['success'])
         failed_count = len(results) - success_count
@@ -555,16 +683,33 @@ def get_history():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         limit = request.args.get('limit', default=100, type=int)
+        # Deprecated, ignored with before_*: OFFSET rescans every skipped row
         offset = request.args.get('offset', default=0, type=int)
 
+        # Keyset paging: pass next_page from the previous response back as before_*
+        before = None
+        before_id = request.args.get('before_id', type=int)
+        before_transferred_at = request.args.get('before_transferred_at')
+        if before_id is not None and before_transferred_at:
+            before = (before_transferred_at, before_id)
+
         history = postgres.get_transfer_history(
-            store_id, status, start_date, end_date, limit, offset
+            store_id, status, start_date, end_date, limit, offset, before
         )
 
+        next_page = None
+        if history and len(history) == limit:
+            last = history[-1]
+            next_page = {
+                'before_transferred_at': last.transferred_at.isoformat(),
+                'before_id': last.id
+            }
+
         return jsonify({
             'success': True,
             'history': history,
-            'total_returned': len(history)
+            'total_returned': len(history),
+            'next_page': next_page
         })
     except Exception as e:
         logger.error(f"Failed to get history: {str(e)}")
@@ -619,7 +764,7 @@ def verify_databases():
         if backoffice_config:
             result['backoffice']['host'] = backoffice_config.get('host')
             result['backoffice']['database'] = backoffice_config.get('database_name')
-            backoffice = SQLServerManager(backoffice_config)
+            backoffice = get_sqlserver_manager(backoffice_config)
             success, msg = backoffice.test_connection()
             result['backoffice']['connection_ok'] = success
             result['backoffice']['message'] = msg
@@ -630,7 +775,7 @@ def verify_databases():
         if inventory_config:
             result['inventory']['host'] = inventory_config.get('host')
             result['inventory']['database'] = inventory_config.get('database_name')
-            inventory = SQLServerManager(inventory_config)
+            inventory = get_sqlserver_manager(inventory_config)
             success, msg = inventory.test_connection()
             result['inventory']['connection_ok'] = success
             result['inventory']['message'] = msg
@@ -706,14 +851,25 @@ def debug_product_lookup():
 # HEALTH CHECK
 # ============================================================================
 
+# (epoch second, encoded body) - liveness probes reuse the body within a second
+_health_response = (0, b'')
+
+
 @app.route('/health', methods=['GET'])
+@app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now(CENTRAL_TZ).isoformat(),
-        'service': 'shopify-quotation-transfer'
-    })
+    """Health check endpoint (no database access)"""
+    global _health_response
+    now = int(time.time())
+    second, body = _health_response
+    if second != now:
+        body = orjson.dumps({
+            'status': 'healthy',
+            'timestamp': datetime.now(CENTRAL_TZ).isoformat(),
+            'service': 'shopify-quotation-transfer'
+        })
+        _health_response = (now, body)
+    return Response(body, mimetype='application/json')
 
 
 # ============================================================================
@@ -734,4 +890,5 @@ def internal_error(e):
 
 
 if __name__ == '__main__':
+    # Local development only; containers run Gunicorn (see gunicorn.conf.py)
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -95,7 +95,7 @@ CREATE TABLE IF NOT EXISTS transfer_history (
 CREATE INDEX idx_transfer_history_store ON transfer_history(shopify_store_id);
 CREATE INDEX idx_transfer_history_status ON transfer_history(status);
 CREATE INDEX idx_transfer_history_order_id ON transfer_history(shopify_order_id);
-CREATE INDEX idx_transfer_history_date ON transfer_history(transferred_at DESC);
+CREATE INDEX idx_transfer_history_date ON transfer_history(transferred_at DESC, id DESC);
 
 -- Prevent duplicate transfers
 CREATE UNIQUE INDEX idx_transfer_history_unique_success
@@ -4,12 +4,185 @@ Fetches orders from Shopify stores using Admin API
 """
 
 import logging
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+# Headers shared by every store; the access token is added per client
+BASE_HEADERS = MappingProxyType({'Content-Type': 'application/json'})
+
+# Transient Shopify responses retried with backoff (honours Retry-After).
+# POST is safe to retry here: the client only sends read-only GraphQL queries.
+SHOPIFY_RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=frozenset(['POST']),
+    raise_on_status=False
+)
+
+# Orders fetched by id are reused for this many seconds (validate, then transfer)
+ORDER_CACHE_TTL = 30
+ORDER_CACHE_MAX_SIZE = 512
+
+# A successful connection test is reused for this many seconds
+CONNECTION_TEST_CACHE_TTL = 300
+
+# Attempts per query when Shopify answers THROTTLED (query cost over the bucket)
+THROTTLE_RETRIES = 3
+
+# Orders whose line items overflow are fetched together, this many aliased
+# order(...) selections per GraphQL request
+LINE_ITEM_BATCH_SIZE = 5
+
+# Selection set for one page of line items
+LINE_ITEMS_PAGE_FIELDS = """
+    pageInfo {
+        hasNextPage
+        endCursor
+    }
+    edges {
+        node {
+            id
+            name
+            quantity
+            variant {
+                barcode
+                sku
+                price
+                title
+            }
+        }
+    }
+"""
+
+# Order fields used by the order list and the single-order lookup
+ORDER_FIELDS = """
+    id
+    name
+    createdAt
+    displayFulfillmentStatus
+    note
+    totalPriceSet {
+        shopMoney {
+            amount
+            currencyCode
+        }
+    }
+    customer {
+        id
+        firstName
+        lastName
+        email
+    }
+    shippingAddress {
+        firstName
+        lastName
+        company
+        address1
+        address2
+        city
+        province
+        provinceCode
+        zip
+        country
+        countryCodeV2
+        phone
+    }
+    lineItems(first: 250) {""" + LINE_ITEMS_PAGE_FIELDS + """}
+"""
+
+# Query documents are fixed; per-call values travel as GraphQL variables
+SHOP_QUERY = """
+query Shop {
+    shop {
+        name
+        email
+        currencyCode
+    }
+}
+"""
+
+ORDERS_QUERY = """
+query Orders($first: Int!, $query: String!, $after: String) {
+    orders(first: $first, query: $query, after: $after) {
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+        edges {
+            node {""" + ORDER_FIELDS + """}
+        }
+    }
+}
+"""
+
+ORDER_BY_ID_QUERY = """
+query Order($id: ID!) {
+    order(id: $id) {""" + ORDER_FIELDS + """}
+}
+"""
+
+LINE_ITEMS_QUERY = """
+query LineItems($id: ID!, $after: String) {
+    order(id: $id) {
+        lineItems(first: 250, after: $after) {""" + LINE_ITEMS_PAGE_FIELDS + """}
+    }
+}
+"""
+
+
+@lru_cache(maxsize=None)
+def line_items_batch_query(size: int) -> str:
+    """Query selecting `size` orders' line items under aliases o0..o{size-1}"""
+    params = ', '.join(f'$id{i}: ID!, $after{i}: String' for i in range(size))
+    selections = ''.join(
+        f"""
+    o{i}: order(id: $id{i}) {{
+        lineItems(first: 250, after: $after{i}) {{{LINE_ITEMS_PAGE_FIELDS}}}
+    }}"""
+        for i in range(size)
+    )
+    return f"query LineItemsBatch({params}) {{{selections}\n}}\n"
+
+
+@dataclass(slots=True, frozen=True)
+class ParsedLineItem:
+    """One order line item as read by the validator (serialized by orjson as an object)"""
+    id: str
+    name: str
+    quantity: int
+    barcode: str
+    sku: str
+    price: float
+    variant_title: str
+
+
+class ShopifyError(Exception):
+    """Base class for Shopify client errors"""
+
+
+class ShopifyNetworkError(ShopifyError):
+    """Shopify could not be reached or answered with an HTTP error"""
+
+
+class ShopifyAPIError(ShopifyError):
+    """Shopify answered with GraphQL errors or an unreadable body"""
+
+
+class ShopifyThrottleError(ShopifyAPIError):
+    """Query still THROTTLED after THROTTLE_RETRIES attempts"""
+
 
 class ShopifyClient:
     """Shopify Admin API GraphQL client"""
@@ -29,80 +202,125 @@ class ShopifyClient:
 
         self.api_token = api_token
         self.graphql_url = f"https://{self.shop_url}/admin/api/2024-01/graphql.json"
-        self.headers = {
-            'Content-Type': 'application/json',
-            'X-Shopify-Access-Token': self.api_token
-        }
+        self.headers = {**BASE_HEADERS, 'X-Shopify-Access-Token': self.api_token}
+
+        # Keep-alive session: reuses the TLS connection across API calls
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=SHOPIFY_RETRY)
+        self.session.mount('https://', adapter)
+
+        # {order_id: (loaded_at, parsed order)} and (loaded_at, message) of the last good test
+        self._order_cache = {}
+        self._order_cache_lock = threading.Lock()
+        self._connection_ok = None
+
+        # Shopify cost bucket as of the last response, used to pace the next query:
+        # points available, max points, points restored per second, monotonic time
+        self._throttle_lock = threading.Lock()
+        self._throttle_status = None
+        # Last requested cost per query document
+        self._query_costs = {}
+
+    def invalidate_order(self, order_id: str):
+        """Drop a cached order so the next get_order_by_id refetches it"""
+        with self._order_cache_lock:
+            self._order_cache.pop(order_id, None)
+
+    def close(self):
+        """Close pooled HTTP connections"""
+        self.session.close()
+
+    def _wait_for_budget(self, query: str):
+        """Sleep until the cost bucket has refilled enough for this query's last known cost"""
+        with self._throttle_lock:
+            cost = self._query_costs.get(query)
+            status = self._throttle_status
+        if not cost or not status:
+            return
+
+        available, maximum, restore_rate, checked_at = status
+        if not restore_rate:
+            return
+        available = min(maximum, available + (time.monotonic() - checked_at) * restore_rate)
+        deficit = cost - available
+        if deficit > 0:
+            logger.info(f"Shopify cost budget low, waiting {deficit / restore_rate:.1f}s")
+            time.sleep(deficit / restore_rate)
+
+    def _record_cost(self, query: str, cost: Dict):
+        """Remember the query cost and bucket state reported in extensions.cost"""
+        throttle = cost.get('throttleStatus') or {}
+        with self._throttle_lock:
+            if cost.get('requestedQueryCost'):
+                self._query_costs[query] = cost['requestedQueryCost']
+            if throttle.get('restoreRate'):
+                self._throttle_status = (
+                    throttle.get('currentlyAvailable', 0),
+                    throttle.get('maximumAvailable', 0),
+                    throttle['restoreRate'],
+                    time.monotonic()
+                )
 
     def _execute_query(self, query: str, variables: Dict = None) -> Dict:
-        """Execute GraphQL query"""
-        try:
-            payload = {'query': query}
-            if variables:
-                payload['variables'] = variables
-
-            response = requests.post(
-                self.graphql_url,
-                json=payload,
-                headers=self.headers,
-                timeout=30
-            )
-
-            response.raise_for_status()
-            result = response.json()
-
-            if 'errors' in result:
-                error_messages = [err.get('message', 'Unknown error') for err in result['errors']]
-                raise Exception(f"GraphQL errors: {', '.join(error_messages)}")
-
-            return result.get('data', {})
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Shopify API request failed: {str(e)}")
-            raise Exception(f"Failed to connect to Shopify: {str(e)}")
-        except Exception as e:
-            logger.error(f"Shopify GraphQL error: {str(e)}")
-            raise
+        """
+        Execute GraphQL query
 
-    def _fetch_all_line_items(self, order_gid: str) -> List[Dict]:
-        """Fetch all line items for an order using cursor pagination"""
+        Paced by Shopify's cost bucket: waits for points to refill before a query
+        known to cost more than is available, and retries THROTTLED responses.
+        HTTP 429 is retried by the session (Retry-After).
+        """
+        payload = {'query': query}
+        if variables:
+            payload['variables'] = variables
+        body = orjson.dumps(payload)
+
+        for attempt in range(THROTTLE_RETRIES + 1):
+            self._wait_for_budget(query)
+
+            try:
+                response = self.session.post(
+                    self.graphql_url,
+                    data=body,
+                    timeout=30
+                )
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Shopify API request failed: {str(e)}")
+                raise ShopifyNetworkError(f"Failed to connect to Shopify: {str(e)}") from e
+
+            try:
+                result = orjson.loads(response.content)
+            except orjson.JSONDecodeError as e:
+                logger.error(f"Shopify returned invalid JSON: {str(e)}")
+                raise ShopifyAPIError(f"Invalid response from Shopify: {str(e)}") from e
+            self._record_cost(query, (result.get('extensions') or {}).get('cost') or {})
+
+            errors = result.get('errors')
+            if not errors:
+                return result.get('data', {})
+
+            throttled = any(
+                (err.get('extensions') or {}).get('code') == 'THROTTLED' for err in errors
+            )
+            if not throttled or attempt == THROTTLE_RETRIES:
+                break
+            if query not in self._query_costs:
+                time.sleep(1)
+
+        error_messages = [err.get('message', 'Unknown error') for err in errors]
+        logger.error(f"Shopify GraphQL errors: {', '.join(error_messages)}")
+        error_cls = ShopifyThrottleError if throttled else ShopifyAPIError
+        raise error_cls(f"GraphQL errors: {', '.join(error_messages)}")
+
+    def _fetch_all_line_items(self, order_gid: str, start_cursor: str = None) -> List[Dict]:
+        """Fetch an order's line items using cursor pagination, after start_cursor if given"""
         all_items = []
-        cursor = None
+        cursor = start_cursor
         has_next = True
 
         while has_next:
-            after_clause = f', after: "{cursor}"' if cursor else ''
-            query = f"""
-            {{
-                order(id: "{order_gid}") {{
-                    lineItems(first: 250{after_clause}) {{
-                        pageInfo {{
-                            hasNextPage
-                            endCursor
-                        }}
-                        edges {{
-                            node {{
-                                id
-                                name
-                                quantity
-                                variant {{
-                                    id
-                                    barcode
-                                    sku
-                                    price
-                                    title
-                                    product {{
-                                        id
-                                        title
-                                    }}
-                                }}
-                            }}
-                        }}
-                    }}
-                }}
-            }}
-            """
-            data = self._execute_query(query)
+            data = self._execute_query(LINE_ITEMS_QUERY, {'id': order_gid, 'after': cursor})
             line_items_data = data.get('order', {}).get('lineItems', {})
 
             for edge in line_items_data.get('edges', []):
@@ -114,27 +332,62 @@ class ShopifyClient:
 
         return all_items
 
+    def _fetch_line_items_batch(self, orders: List[tuple]) -> Dict[str, List[Dict]]:
+        """
+        Fetch all line items for several orders, LINE_ITEM_BATCH_SIZE orders per request
+
+        Each request selects the orders under aliases (o0, o1, ...); orders with
+        another page left are queued again with their endCursor until done.
+
+        Args:
+            orders: (order_gid, cursor) pairs, cursor None to start from the first page
+
+        Returns:
+            Dict of order_gid -> line item nodes
+        """
+        all_items = {order_gid: [] for order_gid, _ in orders}
+        pending = list(orders)
+
+        while pending:
+            group = pending[:LINE_ITEM_BATCH_SIZE]
+            pending = pending[LINE_ITEM_BATCH_SIZE:]
+
+            variables = {}
+            for i, (order_gid, cursor) in enumerate(group):
+                variables[f'id{i}'] = order_gid
+                variables[f'after{i}'] = cursor
+            data = self._execute_query(line_items_batch_query(len(group)), variables)
+
+            for i, (order_gid, _) in enumerate(group):
+                line_items_data = (data.get(f'o{i}') or {}).get('lineItems') or {}
+                all_items[order_gid].extend(
+                    edge.get('node', {}) for edge in line_items_data.get('edges', [])
+                )
+
+                page_info = line_items_data.get('pageInfo') or {}
+                if page_info.get('hasNextPage', False):
+                    pending.append((order_gid, page_info.get('endCursor')))
+
+        return all_items
+
     def test_connection(self) -> tuple[bool, str]:
-        """Test Shopify API connection"""
+        """Test Shopify API connection (successful results cached briefly)"""
+        cached = self._connection_ok
+        if cached and time.monotonic() - cached[0] < CONNECTION_TEST_CACHE_TTL:
+            return True, cached[1]
+
         try:
-            query = """
-            {
-                shop {
-                    name
-                    email
-                    currencyCode
-                }
-            }
-            """
-            data = self._execute_query(query)
+            data = self._execute_query(SHOP_QUERY)
             shop = data.get('shop', {})
 
             if shop:
-                return True, f"Connected to {shop.get('name', 'Unknown')} ({shop.get('email', 'No email')})"
+                message = f"Connected to {shop.get('name', 'Unknown')} ({shop.get('email', 'No email')})"
+                self._connection_ok = (time.monotonic(), message)
+                return True, message
             else:
                 return False, "No shop data returned"
 
-        except Exception as e:
+        except ShopifyError as e:
             return False, str(e)
 
     def get_unfulfilled_orders(self, days_back: int = 14, cursor: str = None,
@@ -150,172 +403,78 @@ class ShopifyClient:
         Returns:
             Dict with orders list and pagination info
         """
-        try:
-            # Calculate date range
-            end_date = datetime.utcnow()
-            start_date = end_date - timedelta(days=days_back)
-            date_filter = start_date.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-            # Build query
-            after_clause = f', after: "{cursor}"' if cursor else ''
-
-            query = f"""
-            {{
-                orders(
-                    first: {limit},
-                    query: "created_at:>'{date_filter}' AND fulfillment_status:unfulfilled"
-                    {after_clause}
-                ) {{
-                    pageInfo {{
-                        hasNextPage
-                        hasPreviousPage
-                        endCursor
-                    }}
-                    edges {{
-                        node {{
-                            id
-                            name
-                            createdAt
-                            displayFulfillmentStatus
-                            note
-                            totalPriceSet {{
-                                shopMoney {{
-                                    amount
-                                    currencyCode
-                                }}
-                            }}
-                            customer {{
-                                id
-                                firstName
-                                lastName
-                                email
-                            }}
-                            shippingAddress {{
-                                firstName
-                                lastName
-                                company
-                                address1
-                                address2
-                                city
-                                province
-                                provinceCode
-                                zip
-                                country
-                                countryCodeV2
-                                phone
-                            }}
-                            lineItems(first: 250) {{
-                                pageInfo {{
-                                    hasNextPage
-                                    endCursor
-                                }}
-                                edges {{
-                                    node {{
-                                        id
-                                        name
-                                        quantity
-                                        variant {{
-                                            id
-                                            barcode
-                                            sku
-                                            price
-                                            title
-                                            product {{
-                                                id
-                                                title
-                                            }}
-                                        }}
-                                    }}
-                                }}
-                            }}
-                        }}
-                    }}
-                }}
-            }}
-            """
-
-            data = self._execute_query(query)
-            orders_data = data.get('orders', {})
-
-            # Parse orders
-            orders = []
-            for edge in orders_data.get('edges', []):
-                node = edge.get('node', {})
-                order_gid = node.get('id', '')
-
-                # Check if order has more line items to fetch
-                line_items_data = node.get('lineItems') or {}
-                line_items_page_info = line_items_data.get('pageInfo', {})
-
-                if line_items_page_info.get('hasNextPage', False):
-                    # Fetch all line items with pagination
-                    all_line_items = self._fetch_all_line_items(order_gid)
-                    orders.append(self._parse_order(node, all_line_items))
-                else:
-                    orders.append(self._parse_order(node))
-
-            return {
-                'orders': orders,
-                'page_info': orders_data.get('pageInfo', {}),
-                'total_fetched': len(orders)
-            }
+        # Calculate date range
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days_back)
+        date_filter = start_date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        data = self._execute_query(ORDERS_QUERY, {
+            'first': limit,
+            'query': f"created_at:>'{date_filter}' AND fulfillment_status:unfulfilled",
+            'after': cursor
+        })
+        orders_data = data.get('orders', {})
+
+        nodes = [edge.get('node', {}) for edge in orders_data.get('edges', [])]
+
+        # Orders with more than one page of line items need extra requests; fetch them
+        # together (aliased), resuming at each order's endCursor after the embedded page
+        overflow = []
+        for node in nodes:
+            line_items_page_info = (node.get('lineItems') or {}).get('pageInfo') or {}
+            if line_items_page_info.get('hasNextPage', False):
+                overflow.append((node.get('id', ''), line_items_page_info.get('endCursor')))
+        more_line_items = self._fetch_line_items_batch(overflow) if overflow else {}
 
-        except Exception as e:
-            logger.error(f"Failed to fetch orders: {str(e)}")
-            raise
+        # Parse orders
+        orders = [self._parse_order(node, more_line_items.get(node.get('id', ''))) for node in nodes]
 
-    def _parse_order(self, order_node: Dict, all_line_items: List[Dict] = None) -> Dict:
+        return {
+            'orders': orders,
+            'page_info': orders_data.get('pageInfo', {}),
+            'total_fetched': len(orders)
+        }
+
+    def _parse_order(self, order_node: Dict, more_line_items: List[Dict] = None) -> Dict:
         """Parse Shopify order node into simplified structure
 
         Args:
             order_node: Raw order data from GraphQL
-            all_line_items: Optional pre-fetched line items (for pagination)
+            more_line_items: Line items fetched after the embedded first page (for pagination)
         """
+        order_gid = order_node.get('id', '')
+
         # Extract customer info (handle null values from Shopify API)
         customer = order_node.get('customer') or {}
+        customer_gid = customer.get('id')
         customer_name = f"{customer.get('firstName', '')} {customer.get('lastName', '')}".strip()
 
         # Extract shipping address (handle null values from Shopify API)
         ship_addr = order_node.get('shippingAddress') or {}
 
-        # Extract line items - use pre-fetched if provided, otherwise from order_node
+        # Extract line items - the page embedded in order_node, then any fetched after it
+        item_nodes = [
+            item_edge.get('node') or {}
+            for item_edge in (order_node.get('lineItems') or {}).get('edges') or []
+        ]
+        if more_line_items:
+            item_nodes.extend(more_line_items)
+
         line_items = []
-        if all_line_items is not None:
-            # Use pre-fetched line items (from pagination)
-            for item_node in all_line_items:
-                variant = item_node.get('variant') or {}
-                product = variant.get('product') or {}
-
-                line_items.append({
-                    'id': item_node.get('id', ''),
-                    'name': item_node.get('name', ''),
-                    'quantity': item_node.get('quantity', 1),
-                    'barcode': variant.get('barcode', ''),
-                    'sku': variant.get('sku', ''),
-                    'price': float(variant.get('price') or 0),
-                    'variant_title': variant.get('title', ''),
-                    'product_id': product.get('id', ''),
-                    'product_title': product.get('title', '')
-                })
-        else:
-            # Extract from order_node
-            line_items_data = order_node.get('lineItems') or {}
-            for item_edge in line_items_data.get('edges') or []:
-                item_node = item_edge.get('node') or {}
-                variant = item_node.get('variant') or {}
-                product = variant.get('product') or {}
-
-                line_items.append({
-                    'id': item_node.get('id', ''),
-                    'name': item_node.get('name', ''),
-                    'quantity': item_node.get('quantity', 1),
-                    'barcode': variant.get('barcode', ''),
-                    'sku': variant.get('sku', ''),
-                    'price': float(variant.get('price') or 0),
-                    'variant_title': variant.get('title', ''),
-                    'product_id': product.get('id', ''),
-                    'product_title': product.get('title', '')
-                })
+        append = line_items.append
+        for item_node in item_nodes:
+            item_get = item_node.get
+            variant_get = (item_get('variant') or {}).get
+
+            append(ParsedLineItem(
+                id=item_get('id', ''),
+                name=item_get('name', ''),
+                quantity=item_get('quantity', 1),
+                barcode=variant_get('barcode') or '',
+                sku=variant_get('sku', ''),
+                price=float(variant_get('price') or 0),
+                variant_title=variant_get('title', '')
+            ))
 
         # Extract total (handle null values from Shopify API)
         total_price_data = order_node.get('totalPriceSet') or {}
@@ -324,8 +483,8 @@ class ShopifyClient:
         currency = total_price_set.get('currencyCode') or 'USD'
 
         return {
-            'id': order_node.get('id', '').split('/')[-1],  # Extract numeric ID
-            'gid': order_node.get('id', ''),  # Full GraphQL ID
+            'id': order_gid.rpartition('/')[2],  # Extract numeric ID
+            'gid': order_gid,  # Full GraphQL ID
             'name': order_node.get('name', ''),
             'created_at': order_node.get('createdAt', ''),
             'fulfillment_status': order_node.get('displayFulfillmentStatus', ''),
@@ -333,7 +492,7 @@ class ShopifyClient:
             'total_amount': total_amount,
             'currency': currency,
             'customer': {
-                'id': customer.get('id', '').split('/')[-1] if customer.get('id') else None,
+                'id': customer_gid.rpartition('/')[2] if customer_gid else None,
                 'name': customer_name,
                 'email': customer.get('email', ''),
                 'first_name': customer.get('firstName', ''),
@@ -359,7 +518,7 @@ class ShopifyClient:
 
     def get_order_by_id(self, order_id: str) -> Optional[Dict]:
         """
-        Get single order by ID
+        Get single order by ID, reusing it for ORDER_CACHE_TTL seconds
 
         Args:
             order_id: Shopify order ID (numeric or GID format)
@@ -367,92 +526,48 @@ class ShopifyClient:
         Returns:
             Parsed order dict or None if not found
         """
-        try:
-            # Convert to GID format if needed
-            if not order_id.startswith('gid://'):
-                order_gid = f"gid://shopify/Order/{order_id}"
-            else:
-                order_gid = order_id
-
-            query = f"""
-            {{
-                order(id: "{order_gid}") {{
-                    id
-                    name
-                    createdAt
-                    displayFulfillmentStatus
-                    note
-                    totalPriceSet {{
-                        shopMoney {{
-                            amount
-                            currencyCode
-                        }}
-                    }}
-                    customer {{
-                        id
-                        firstName
-                        lastName
-                        email
-                    }}
-                    shippingAddress {{
-                        firstName
-                        lastName
-                        company
-                        address1
-                        address2
-                        city
-                        province
-                        provinceCode
-                        zip
-                        country
-                        countryCodeV2
-                        phone
-                    }}
-                    lineItems(first: 250) {{
-                        pageInfo {{
-                            hasNextPage
-                            endCursor
-                        }}
-                        edges {{
-                            node {{
-                                id
-                                name
-                                quantity
-                                variant {{
-                                    id
-                                    barcode
-                                    sku
-                                    price
-                                    title
-                                    product {{
-                                        id
-                                        title
-                                    }}
-                                }}
-                            }}
-                        }}
-                    }}
-                }}
-            }}
-            """
-
-            data = self._execute_query(query)
-            order_node = data.get('order')
-
-            if not order_node:
-                return None
-
-            # Check if order has more line items to fetch
-            line_items_data = order_node.get('lineItems') or {}
-            line_items_page_info = line_items_data.get('pageInfo', {})
+        now = time.monotonic()
+        with self._order_cache_lock:
+            cached = self._order_cache.get(order_id)
+        if cached and now - cached[0] < ORDER_CACHE_TTL:
+            return cached[1]
+
+        order = self._fetch_order(order_id)
+        if order:
+            with self._order_cache_lock:
+                if len(self._order_cache) >= ORDER_CACHE_MAX_SIZE:
+                    self._order_cache = {
+                        key: entry for key, entry in self._order_cache.items()
+                        if now - entry[0] < ORDER_CACHE_TTL
+                    }
+                    if len(self._order_cache) >= ORDER_CACHE_MAX_SIZE:
+                        self._order_cache.clear()
+                self._order_cache[order_id] = (now, order)
+        return order
+
+    def _fetch_order(self, order_id: str) -> Optional[Dict]:
+        """Fetch and parse a single order from Shopify"""
+        # Convert to GID format if needed
+        if not order_id.startswith('gid://'):
+            order_gid = f"gid://shopify/Order/{order_id}"
+        else:
+            order_gid = order_id
 
-            if line_items_page_info.get('hasNextPage', False):
-                # Fetch all line items with pagination
-                all_line_items = self._fetch_all_line_items(order_gid)
-                return self._parse_order(order_node, all_line_items)
+        data = self._execute_query(ORDER_BY_ID_QUERY, {'id': order_gid})
+        order_node = data.get('order')
+
+        if not order_node:
+            return None
 
-            return self._parse_order(order_node)
+        # Check if order has more line items to fetch
+        line_items_data = order_node.get('lineItems') or {}
+        line_items_page_info = line_items_data.get('pageInfo', {})
+
+        if line_items_page_info.get('hasNextPage', False):
+            # Fetch the remaining line items, continuing after the embedded page
+            more_line_items = self._fetch_all_line_items(
+                order_gid, line_items_page_info.get('endCursor')
+            )
+            return self._parse_order(order_node, more_line_items)
 
-        except Exception as e:
-            logger.error(f"Failed to fetch order {order_id}: {str(e)}")
-            raise
+        return self._parse_order(order_node)
@@ -5,11 +5,75 @@ Handles 2-database lookup and product copying
 """
 
 import logging
-from typing import Dict, List
-from app.database import SQLServerManager
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Union
+from app.database import SQLServerManager, sqlserver_lookups
+from app.shopify_client import ParsedLineItem
 
 logger = logging.getLogger(__name__)
 
+# BackOffice application lock guarding the Inventory -> BackOffice copy step
+# against concurrent transfers (any thread or Gunicorn worker)
+ITEM_COPY_LOCK = 'shopify-quotation:item-copy'
+
+# BackOffice products found by barcode, reused across orders for a few minutes:
+# {(backoffice settings, barcode): (loaded_at, product)}
+PRODUCT_CACHE_TTL = 300
+PRODUCT_CACHE_MAX_SIZE = 1024
+_product_cache = {}
+_product_cache_lock = threading.Lock()
+
+# Barcodes found in neither database skip the Inventory query for a minute, and
+# the BackOffice query too for the first half of it:
+# {(backoffice settings, inventory settings, barcode): missed_at}
+RECENT_MISS_TTL = 60
+FULL_MISS_TTL = 30
+_recent_misses = {}
+_recent_misses_lock = threading.Lock()
+
+# (BackOffice settings, Inventory database) pairs on one server whose single-query
+# lookup failed fall back to separate BackOffice and Inventory queries:
+# {key: retry_at_monotonic}. The login being unable to read the Inventory database
+# (permission denied, invalid object, no database access) is permanent; any other
+# error is retried after CROSS_DATABASE_RETRY_AFTER seconds
+CROSS_DATABASE_DENIED_ERRORS = (229, 208, 916)
+CROSS_DATABASE_RETRY_AFTER = 300
+_cross_database_unavailable = {}
+
+
+@dataclass(slots=True)
+class ValidatedProduct:
+    """BackOffice Items_tbl row matched to one Shopify line item"""
+    ProductID: Optional[int]
+    CateID: Optional[int]
+    SubCateID: Optional[int]
+    ProductSKU: Optional[str]
+    ProductUPC: Optional[str]
+    ProductDescription: Optional[str]
+    UnitPrice: Optional[Union[Decimal, float]]
+    UnitCost: Optional[Union[Decimal, float]]
+    ItemSize: Optional[str]
+    ItemWeight: Optional[str]
+    UnitID: Optional[int]
+    ItemTaxID: Optional[int]
+    shopify_quantity: int
+    shopify_price: float
+
+    @classmethod
+    def from_product(cls, product: Dict, quantity: int, price: float) -> 'ValidatedProduct':
+        """Build from a get_products_by_upc_batch / copy row plus the Shopify line values"""
+        get = product.get
+        return cls(
+            get('ProductID'), get('CateID'), get('SubCateID'), get('ProductSKU'),
+            get('ProductUPC'), get('ProductDescription'), get('UnitPrice'), get('UnitCost'),
+            get('ItemSize'), get('ItemWeight'), get('UnitID'), get('ItemTaxID'),
+            quantity, price
+        )
+
 
 def normalize_barcode(barcode: str) -> str:
     """
@@ -25,18 +89,101 @@ class ProductValidator:
     """Validates products and copies from Inventory to BackOffice if needed"""
 
     def __init__(self, backoffice_manager: SQLServerManager,
-                 inventory_manager: SQLServerManager):
+                 inventory_manager: SQLServerManager,
+                 speculative_inventory: bool = True):
         """
         Initialize validator with database managers
 
         Args:
             backoffice_manager: BackOffice SQL Server manager
             inventory_manager: Inventory SQL Server manager
+            speculative_inventory: Query Inventory concurrently with BackOffice instead
+                of waiting to learn which barcodes BackOffice is missing
         """
         self.backoffice = backoffice_manager
         self.inventory = inventory_manager
+        self.speculative_inventory = speculative_inventory
+
+    def _cached_products(self, barcodes: Iterable[str]) -> Dict[str, Dict]:
+        """BackOffice products for these barcodes still within PRODUCT_CACHE_TTL"""
+        settings = self.backoffice.settings
+        now = time.monotonic()
+        hits = {}
+        with _product_cache_lock:
+            for barcode in barcodes:
+                cached = _product_cache.get((settings, barcode))
+                if cached and now - cached[0] < PRODUCT_CACHE_TTL:
+                    hits[barcode] = cached[1]
+        return hits
+
+    def _remember_products(self, products: Dict[str, Dict]):
+        """Cache BackOffice products by barcode (found, or just copied from Inventory)"""
+        if not products:
+            return
+        global _product_cache
+        settings = self.backoffice.settings
+        now = time.monotonic()
+        with _product_cache_lock:
+            if len(_product_cache) + len(products) > PRODUCT_CACHE_MAX_SIZE:
+                _product_cache = {
+                    key: entry for key, entry in _product_cache.items()
+                    if now - entry[0] < PRODUCT_CACHE_TTL
+                }
+                if len(_product_cache) + len(products) > PRODUCT_CACHE_MAX_SIZE:
+                    _product_cache.clear()
+            for barcode, product in products.items():
+                _product_cache[(settings, barcode)] = (now, product)
+
+    def _miss_settings(self):
+        """Miss cache entries hold for one BackOffice + Inventory pair"""
+        return self.backoffice.settings, self.inventory.settings
+
+    def _recently_missed(self, barcodes: Iterable[str], ttl: float = RECENT_MISS_TTL) -> set:
+        """Barcodes neither database had within the last `ttl` seconds"""
+        backoffice_settings, inventory_settings = self._miss_settings()
+        now = time.monotonic()
+        with _recent_misses_lock:
+            return {
+                barcode for barcode in barcodes
+                if now - _recent_misses.get(
+                    (backoffice_settings, inventory_settings, barcode), -ttl
+                ) < ttl
+            }
 
-    def validate_order_products(self, line_items: List[Dict]) -> Dict:
+    def _remember_misses(self, barcodes: Iterable[str]):
+        """Record barcodes neither database has, dropping expired entries"""
+        if not barcodes:
+            return
+        global _recent_misses
+        backoffice_settings, inventory_settings = self._miss_settings()
+        now = time.monotonic()
+        with _recent_misses_lock:
+            _recent_misses = {
+                key: missed_at for key, missed_at in _recent_misses.items()
+                if now - missed_at < RECENT_MISS_TTL
+            }
+            for barcode in barcodes:
+                _recent_misses[(backoffice_settings, inventory_settings, barcode)] = now
+
+    def _forget_misses(self, barcodes: Iterable[str]):
+        """Drop barcodes that now exist in BackOffice from the miss cache"""
+        backoffice_settings, inventory_settings = self._miss_settings()
+        with _recent_misses_lock:
+            for barcode in barcodes:
+                _recent_misses.pop((backoffice_settings, inventory_settings, barcode), None)
+
+    def _cross_database_key(self):
+        """Key for a single-query BackOffice + Inventory lookup, None when not possible"""
+        backoffice, inventory = self.backoffice, self.inventory
+        if (backoffice.host, backoffice.port) != (inventory.host, inventory.port):
+            return None
+        if backoffice.database == inventory.database:
+            return None
+        key = (backoffice.settings, inventory.database)
+        retry_at = _cross_database_unavailable.get(key)
+        return None if retry_at is not None and time.monotonic() < retry_at else key
+
+    def validate_order_products(self, line_items: List[ParsedLineItem]) -> Dict:
         """
         Validate all products in order using batch queries
 
@@ -48,13 +195,13 @@ class ProductValidator:
         5. Match products back to line items
 
         Args:
-            line_items: List of Shopify line items with barcode, quantity, etc.
+            line_items: Parsed Shopify line items with barcode, quantity, etc.
 
         Returns:
             Dict with validation results:
             {
                 'valid': bool,
-                'products': List[Dict],  # Validated products with database IDs
+                'products': List[ValidatedProduct],  # Validated products with database IDs
                 'missing': List[Dict],   # Products not found in any database
                 'copied': List[Dict],    # Products copied from Inventory
                 'errors': List[str]
@@ -75,18 +222,16 @@ class ProductValidator:
         }
 
         # Build mapping of barcode -> line item(s)
-        barcode_to_items = {}
+        barcode_to_items = defaultdict(list)
         items_without_barcode = []
 
         for item in line_items:
-            barcode = item.get('barcode', '').strip()
+            barcode = item.barcode.strip()
 
             if not barcode:
                 items_without_barcode.append(item)
                 continue
 
-            if barcode not in barcode_to_items:
-                barcode_to_items[barcode] = []
             barcode_to_items[barcode].append(item)
 
         # Handle items without barcodes
@@ -94,13 +239,13 @@ class ProductValidator:
             result['valid'] = False
             result['missing'].append({
                 'barcode': 'NONE',
-                'name': item.get('name', 'Unknown'),
-                'sku': item.get('sku', ''),
-                'quantity': item.get('quantity', 0),
+                'name': item.name,
+                'sku': item.sku,
+                'quantity': item.quantity,
                 'reason': 'No barcode provided by Shopify'
             })
             result['errors'].append(
-                f"Product '{item.get('name')}' has no barcode"
+                f"Product '{item.name}' has no barcode"
             )
 
         if not barcode_to_items:
@@ -110,47 +255,131 @@ class ProductValidator:
         result['diagnostics']['barcodes_searched'] = all_barcodes
 
         try:
-            # BATCH QUERY #1: Check all barcodes in BackOffice (1 query instead of N)
-            logger.info(f"Batch querying BackOffice for {len(all_barcodes)} products...")
-            backoffice_products = self.backoffice.get_products_by_upc_batch(all_barcodes)
+            # Barcodes resolved by a recent order skip the BackOffice round trip
+            backoffice_products = self._cached_products(all_barcodes)
+            uncached_barcodes = [b for b in all_barcodes if b not in backoffice_products]
+
+            # Barcodes neither database had moments ago skip both queries
+            fresh_misses = self._recently_missed(uncached_barcodes, FULL_MISS_TTL)
+            if fresh_misses:
+                logger.info(f"Skipping lookup of {len(fresh_misses)} barcodes missing from both databases")
+                uncached_barcodes = [b for b in uncached_barcodes if b not in fresh_misses]
+
+            # Inventory is looked up speculatively; its rows are only used for BackOffice misses
+            recent_misses = self._recently_missed(uncached_barcodes)
+            speculative_barcodes = [b for b in uncached_barcodes if b not in recent_misses]
+            speculative_products = None
+            inventory_future = None
+            found_products = None
+
+            # Both databases on one server: a single UNION ALL round trip
+            cross_database_key = self._cross_database_key() if self.speculative_inventory else None
+            if uncached_barcodes and cross_database_key:
+                try:
+                    logger.info(f"Querying BackOffice + Inventory for {len(uncached_barcodes)} products "
+                                f"({len(backoffice_products)} cached)...")
+                    found_products, speculative_products = self.backoffice.get_products_by_upc_batch_with(
+                        uncached_barcodes, self.inventory.database, speculative_barcodes
+                    )
+                except Exception as cross_error:
+                    logger.warning(f"Cross-database lookup unavailable, using separate queries: {str(cross_error)}")
+                    denied = bool(cross_error.args) and cross_error.args[0] in CROSS_DATABASE_DENIED_ERRORS
+                    _cross_database_unavailable[cross_database_key] = (
+                        float('inf') if denied else time.monotonic() + CROSS_DATABASE_RETRY_AFTER
+                    )
+
+            if found_products is None:
+                if self.speculative_inventory and speculative_barcodes:
+                    inventory_future = sqlserver_lookups.submit(
+                        self.inventory.get_products_by_upc_batch, speculative_barcodes
+                    )
+
+                # BATCH QUERY #1: Check all barcodes in BackOffice (1 query instead of N)
+                if uncached_barcodes:
+                    logger.info(f"Batch querying BackOffice for {len(uncached_barcodes)} products "
+                                f"({len(backoffice_products)} cached)...")
+                    found_products = self.backoffice.get_products_by_upc_batch(uncached_barcodes)
+
+            if found_products:
+                self._remember_products(found_products)
+                backoffice_products.update(found_products)
             logger.info(f"Found {len(backoffice_products)} products in BackOffice")
             result['diagnostics']['backoffice_found'] = len(backoffice_products)
 
-            # Identify missing barcodes
-            missing_barcodes = [b for b in all_barcodes if b not in backoffice_products]
+            # Identify missing barcodes (recent Inventory misses are not asked again)
+            missing_barcodes = (
+                barcode_to_items.keys() - backoffice_products.keys() - recent_misses - fresh_misses
+            )
 
             # BATCH QUERY #2: Check missing barcodes in Inventory (1 query instead of N)
             inventory_products = {}
             if missing_barcodes:
-                logger.info(f"Batch querying Inventory for {len(missing_barcodes)} missing products...")
-                inventory_products = self.inventory.get_products_by_upc_batch(missing_barcodes)
+                if inventory_future is not None:
+                    speculative_products = inventory_future.result()
+                if speculative_products is not None:
+                    inventory_products = {
+                        b: speculative_products[b] for b in missing_barcodes if b in speculative_products
+                    }
+                else:
+                    logger.info(f"Batch querying Inventory for {len(missing_barcodes)} missing products...")
+                    inventory_products = self.inventory.get_products_by_upc_batch(list(missing_barcodes))
                 logger.info(f"Found {len(inventory_products)} products in Inventory")
                 result['diagnostics']['inventory_queried'] = True
                 result['diagnostics']['inventory_found'] = len(inventory_products)
-
-            # Copy products from Inventory to BackOffice
-            for barcode, inventory_product in inventory_products.items():
-                try:
-                    logger.info(f"Copying product {barcode} from Inventory to BackOffice...")
-                    copied_product = self.backoffice.copy_product_from_inventory(inventory_product)
-
-                    # Add to backoffice_products dict (no re-fetch needed!)
-                    backoffice_products[barcode] = copied_product
-
-                    result['copied'].append({
-                        'barcode': barcode,
-                        'name': inventory_product.get('ProductDescription', ''),
-                        'product_id': copied_product.get('ProductID')
-                    })
-                    logger.info(f"Successfully copied product {barcode}")
-
-                except Exception as copy_error:
-                    logger.error(f"Failed to copy product {barcode}: {str(copy_error)}")
-                    result['valid'] = False
-                    result['errors'].append(
-                        f"Failed to copy product {barcode} from Inventory: {str(copy_error)}"
-                    )
-                    # Will be marked as missing below
+                self._remember_misses(missing_barcodes - inventory_products.keys())
+
+            # Copy under a BackOffice lock: concurrent transfers may be missing the
+            # same product, and only one of them may create it in BackOffice. Orders
+            # fully covered by BackOffice skip the lock (and the copy step) entirely
+            if inventory_products:
+                with self.backoffice.app_lock(ITEM_COPY_LOCK):
+                    # Drop products another transfer copied since the first lookup
+                    already_copied = self.backoffice.get_products_by_upc_batch(list(inventory_products))
+                    self._remember_products(already_copied)
+                    for barcode, product in already_copied.items():
+                        backoffice_products[barcode] = product
+                        inventory_products.pop(barcode, None)
+
+                    # Copy products from Inventory to BackOffice (one batch, per-product on failure)
+                    copied_products = None
+                    if inventory_products:
+                        try:
+                            logger.info(f"Copying {len(inventory_products)} products from Inventory to BackOffice...")
+                            copied_products = self.backoffice.copy_products_from_inventory_bulk(
+                                list(inventory_products.values())
+                            )
+                        except Exception as bulk_error:
+                            logger.warning(f"Bulk copy failed, copying products one by one: {str(bulk_error)}")
+
+                    for barcode, inventory_product in inventory_products.items():
+                        try:
+                            if copied_products is not None:
+                                copied_product = copied_products.get(barcode)
+                                if copied_product is None:
+                                    raise ValueError("no ProductID returned")
+                            else:
+                                logger.info(f"Copying product {barcode} from Inventory to BackOffice...")
+                                copied_product = self.backoffice.copy_product_from_inventory(inventory_product)
+
+                            # Add to backoffice_products dict (no re-fetch needed!)
+                            backoffice_products[barcode] = copied_product
+                            self._remember_products({barcode: copied_product})
+                            self._forget_misses((barcode,))
+
+                            result['copied'].append({
+                                'barcode': barcode,
+                                'name': inventory_product.get('ProductDescription', ''),
+                                'product_id': copied_product.get('ProductID')
+                            })
+                            logger.info(f"Successfully copied product {barcode}")
+
+                        except Exception as copy_error:
+                            logger.error(f"Failed to copy product {barcode}: {str(copy_error)}")
+                            result['valid'] = False
+                            result['errors'].append(
+                                f"Failed to copy product {barcode} from Inventory: {str(copy_error)}"
+                            )
+                            # Will be marked as missing below
 
             # Match products back to line items
             for barcode, items in barcode_to_items.items():
@@ -159,11 +388,9 @@ class ProductValidator:
                 if product:
                     # Product found (either in BackOffice or copied from Inventory)
                     for item in items:
-                        result['products'].append({
-                            **product,
-                            'shopify_quantity': item.get('quantity', 1),
-                            'shopify_price': item.get('price', 0)
-                        })
+                        result['products'].append(
+                            ValidatedProduct.from_product(product, item.quantity, item.price)
+                        )
                 else:
                     # Product not found in either database
                     result['valid'] = False
@@ -176,13 +403,13 @@ class ProductValidator:
 
                         result['missing'].append({
                             'barcode': barcode,
-                            'name': item.get('name', 'Unknown'),
-                            'sku': item.get('sku', ''),
-                            'quantity': item.get('quantity', 0),
+                            'name': item.name,
+                            'sku': item.sku,
+                            'quantity': item.quantity,
                             'reason': reason
                         })
                         result['errors'].append(
-                            f"Product '{item.get('name')}' (barcode: {barcode}) not found in any database"
+                            f"Product '{item.name}' (barcode: {barcode}) not found in any database"
                         )
 
         except Exception as e:
@@ -219,8 +446,12 @@ class ProductValidator:
             return result
 
         try:
-            # Check BackOffice first
-            product = self.backoffice.get_product_by_upc(barcode)
+            # Check BackOffice first (cache, then database)
+            product = self._cached_products((barcode,)).get(barcode)
+            if product is None:
+                product = self.backoffice.get_product_by_upc(barcode)
+                if product:
+                    self._remember_products({barcode: product})
 
             if product:
                 result['found'] = True
@@ -228,8 +459,13 @@ class ProductValidator:
                 result['product'] = product
                 return result
 
-            # Check Inventory
-            inventory_product = self.inventory.get_product_by_upc(barcode)
+            # Check Inventory, unless it recently did not have this barcode either
+            if self._recently_missed((barcode,)):
+                inventory_product = None
+            else:
+                inventory_product = self.inventory.get_product_by_upc(barcode)
+                if not inventory_product:
+                    self._remember_misses((barcode,))
 
             if inventory_product:
                 result['found'] = True
@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration for Shopify Quotation Transfer
+Threaded workers: every endpoint is I/O-bound (Shopify, PostgreSQL, SQL Server)
+"""
+
+import logging
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# One worker per CPU (up to 8). Quotation-number allocation and the Inventory copy
+# step are serialized in SQL Server, so workers need no shared locks; settings
+# caches are per worker, so a change reaches the others within SETTINGS_CACHE_TTL
+workers = int(os.getenv('GUNICORN_WORKERS', min(multiprocessing.cpu_count(), 8)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+# PostgreSQL connections for all workers together (PostgreSQL's max_connections,
+# 100 by default, minus reserved slots). Each worker holds its own pool, so the
+# budget is split between them (at most the usual 25 each) unless PG_POOL_MAX is set
+PG_CONNECTIONS_TOTAL = int(os.getenv('PG_CONNECTIONS_TOTAL', 90))
+os.environ.setdefault('PG_POOL_MAX', str(min(max(PG_CONNECTIONS_TOTAL // workers, 5), 25)))
+
+# Multi-order transfers can take a while against remote SQL Server
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 300))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Liveness probes are not written to the access log
+HEALTH_PATHS = ('/health', '/api/health')
+
+
+class _SkipHealthChecks(logging.Filter):
+    """Drop access log lines for liveness probes"""
+
+    def filter(self, record):
+        args = record.args if isinstance(record.args, dict) else {}
+        return args.get('U') not in HEALTH_PATHS
+
+
+def post_worker_init(worker):
+    logging.getLogger('gunicorn.access').addFilter(_SkipHealthChecks())
+
+
+def worker_exit(server, worker):
+    from app.database import close_sqlserver_connections
+    close_sqlserver_connections()
@@ -0,0 +1,7 @@
+-- Migration: Add id to the transfer_history date index
+-- Date: 2026-10-15
+-- Description: History pages by (transferred_at, id) keyset; index both columns so the
+--              ORDER BY / row comparison is served straight from the index
+
+DROP INDEX IF EXISTS idx_transfer_history_date;
+CREATE INDEX idx_transfer_history_date ON transfer_history(transferred_at DESC, id DESC);
@@ -0,0 +1,27 @@
+"""
+One-off migration: re-encrypt SQL connection passwords still stored as legacy
+Fernet tokens with ChaCha20-Poly1305
+
+Run it by hand once the current release is known good. Releases before the
+AEAD change cannot read re-encrypted passwords, so after this a rollback needs
+the SQL connections saved again. run_migrations.sh does not run it.
+
+    docker compose exec -T app python - < migrations/reencrypt_sql_passwords.py
+"""
+
+import logging
+
+from app.database import PostgreSQLManager
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+if __name__ == '__main__':
+    postgres = PostgreSQLManager()
+    try:
+        count = postgres.reencrypt_legacy_passwords()
+        print(f"Re-encrypted {count} SQL connection password(s)")
+    finally:
+        postgres.close()